@@ -0,0 +1,74 @@
+""" Wall time of a scheduler round (pull_payouts, send_payout with
+associate_all, then confirm_payouts) over several currencies, running them
+one at a time and concurrently. Every currency talks to one stand-in SC
+that waits --delay seconds before each response, standing in for SC's
+network latency.
+
+    python -m bench.bench_concurrency [--delay 0.05] [--payouts 2000] [currencies]
+"""
+import argparse
+import logging
+import time
+
+from tabulate import tabulate
+
+from simplecoin_rpc_client.scheduler import PayoutManager
+from tests.fakes import (FakeSC, FakeCoinDaemon, make_client, close_client,
+                         make_payouts)
+
+
+def run_round(sc, daemons, concurrency):
+    """ Seconds for one round with fresh databases """
+    clients = {}
+    for i, daemon in enumerate(daemons):
+        currency = 'TS{}'.format(i)
+        clients[currency] = make_client(sc, daemon, currency_code=currency,
+                                        min_confirms=0)
+    manager = PayoutManager(logging.getLogger('bench'), clients,
+                            dict((currency, client.coin_rpc) for currency, client
+                                 in clients.iteritems()), concurrency)
+    try:
+        start = time.time()
+        manager.pull_payouts()
+        manager.send_payout()
+        for daemon in daemons:
+            daemon.mine()
+        manager.confirm_payouts()
+        return time.time() - start
+    finally:
+        for client in clients.itervalues():
+            close_client(client)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--delay', type=float, default=0.05)
+    parser.add_argument('--payouts', type=int, default=2000)
+    parser.add_argument('currencies', type=int, nargs='?', default=4)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    sc = FakeSC(make_payouts(args.payouts, addresses=min(args.payouts, 500)))
+    sc.delay = args.delay
+    sc.start()
+    daemons = [FakeCoinDaemon(balance=1000000).start()
+               for _ in xrange(args.currencies)]
+    try:
+        serial = run_round(sc, daemons, 1)
+        concurrent = run_round(sc, daemons, args.currencies)
+    finally:
+        sc.stop()
+        for daemon in daemons:
+            daemon.stop()
+
+    print("{} currencies, {:,} payouts each, {:.0f}ms SC latency"
+          .format(args.currencies, args.payouts, args.delay * 1000))
+    print(tabulate([("One at a time", 1, serial, 1.0),
+                    ("Concurrent", args.currencies, concurrent,
+                     serial / concurrent)],
+                   headers=["Mode", "Concurrency", "Round (s)", "Speedup"],
+                   tablefmt="grid", floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+""" Times send_payout on a dust heavy backlog, against a local stand-in SC and
+coin daemon. Dust addresses are below minimum_tx_output and get skipped.
+
+    python -m bench.bench_dust [payouts] [dust addresses]
+"""
+import logging
+import sys
+import time
+
+from tabulate import tabulate
+
+from tests.fakes import (FakeSC, FakeCoinDaemon, make_client, close_client,
+                         make_address)
+
+
+def backlog(payouts, dust_addresses):
+    """ Half the payouts go to dust_addresses addresses with amounts under
+    the minimum output, the other half to 2000 addresses above it """
+    rows = []
+    for i in xrange(payouts):
+        if i % 2:
+            address, amount = make_address(100000 + i % dust_addresses), 0.0000001
+        else:
+            address, amount = make_address(i % 2000), 0.001
+        rows.append(['user{}'.format(i), address, amount, 'pid{}'.format(i)])
+    return rows
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    args = [int(arg) for arg in sys.argv[1:]]
+    payouts = args[0] if args else 30000
+    dust_addresses = args[1] if len(args) > 1 else 8000
+
+    sc = FakeSC(backlog(payouts, dust_addresses)).start()
+    daemon = FakeCoinDaemon(balance=100000).start()
+    client = make_client(sc, daemon, minimum_tx_output=0.0001)
+    try:
+        client.pull_payouts()
+        start = time.time()
+        results = client.send_payout()
+        elapsed = time.time() - start
+        lock_stats = sorted(client.lock_stats.iteritems())
+    finally:
+        close_client(client)
+        sc.stop()
+        daemon.stop()
+
+    print("{:,} payouts, {:,} dust addresses: send_payout took {:.2f}s for "
+          "{:,} transactions paying {:,} payouts"
+          .format(payouts, dust_addresses, elapsed, len(results),
+                  sum(count for _, _, count in results)))
+    print(tabulate([(action, count, total, longest)
+                    for action, (count, total, longest) in lock_stats],
+                   headers=["Exclusive lock held to", "Times", "Total (s)",
+                            "Max (s)"], tablefmt="grid", floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+""" Compares plain and gzipped SC traffic against a local stand-in SC: an
+associate_payouts post of N pids (request compression) and a get_payouts
+response of N payouts (response compression). Times are measured on
+localhost, so they mostly show the compression cost. The estimated transfer
+time at --mbit shows what the smaller body saves on a real link.
+
+    python -m bench.bench_gzip [--mbit 10] [items ...]
+"""
+import argparse
+import logging
+import time
+
+from tabulate import tabulate
+
+from tests.fakes import (FakeSC, FakeCoinDaemon, make_client, close_client,
+                         make_payouts)
+
+
+def best_of(func, runs=3):
+    times = []
+    for _ in xrange(runs):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def associate(client, sc, count, compress):
+    client.config['compress_requests'] = compress
+    data = {'coin_txid': 'a' * 64, 'tx_fee': 0.0001, 'currency': 'TST',
+            'pids': ['pid{}'.format(i) for i in xrange(count)]}
+    seconds = best_of(lambda: client.post('associate_payouts', data=data))
+    return sc.calls_to('associate_payouts')[-1].size, seconds
+
+
+def get_payouts(client, sc, count, compress):
+    sc.compress_responses = compress
+    sc.payouts = make_payouts(count, addresses=min(count, 20000))
+    seconds = best_of(lambda: list(client.post('get_payouts', data={},
+                                               stream=True, items='pids')))
+    return sc.response_sizes[-1], seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mbit', type=float, default=10)
+    parser.add_argument('items', type=int, nargs='*')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARN)
+    bytes_per_second = args.mbit * 1000000 / 8.0
+
+    sc = FakeSC().start()
+    daemon = FakeCoinDaemon().start()
+    client = make_client(sc, daemon, compress_min_size=1024)
+    rows = []
+    try:
+        for count in args.items or [1000, 10000, 100000]:
+            for name, func in (('associate_payouts', associate),
+                               ('get_payouts', get_payouts)):
+                plain_size, plain = func(client, sc, count, False)
+                gzip_size, gzipped = func(client, sc, count, True)
+                rows.append((name, count, plain_size, gzip_size,
+                             float(plain_size) / gzip_size, plain, gzipped,
+                             plain + plain_size / bytes_per_second,
+                             gzipped + gzip_size / bytes_per_second))
+    finally:
+        close_client(client)
+        sc.stop()
+        daemon.stop()
+
+    link = "@ {:g} Mbit/s (s)".format(args.mbit)
+    print(tabulate(rows, headers=["Call", "Items", "Plain bytes", "Gzip bytes",
+                                  "Ratio", "Plain (s)", "Gzip (s)",
+                                  "Plain " + link, "Gzip " + link],
+                   tablefmt="grid", floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    main()
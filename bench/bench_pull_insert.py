@@ -0,0 +1,48 @@
+""" Times pull_payouts against a local stand-in SC, for a pull where every
+payout is new and for a repeat pull where every payout already exists.
+
+    python -m bench.bench_pull_insert [rows ...]
+"""
+import logging
+import sys
+import time
+
+from tabulate import tabulate
+
+from tests.fakes import (FakeSC, FakeCoinDaemon, make_client, close_client,
+                         make_payouts)
+
+
+def run(rows):
+    sc = FakeSC(make_payouts(rows, addresses=min(rows, 20000))).start()
+    daemon = FakeCoinDaemon().start()
+    # Always a full pull, so the repeat pull sees every payout again
+    client = make_client(sc, daemon, incremental_pull=False)
+    try:
+        start = time.time()
+        client.pull_payouts()
+        new = time.time() - start
+
+        start = time.time()
+        client.pull_payouts()
+        repeat = time.time() - start
+    finally:
+        close_client(client)
+        sc.stop()
+        daemon.stop()
+    return rows, new, repeat
+
+
+def main():
+    logging.basicConfig(level=logging.WARN)
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    results = [run(rows) for rows in sizes]
+    print(tabulate([(rows, new, rows / new, repeat, rows / repeat)
+                    for rows, new, repeat in results],
+                   headers=["Rows", "New pull (s)", "Rows/s",
+                            "Repeat pull (s)", "Rows/s"],
+                   tablefmt="grid", floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+""" Peak memory of pull_payouts as the get_payouts response grows. Each pull
+runs in a fresh child process against a stand-in SC in this one, and reports
+its peak RSS. Flat numbers mean the payload is streamed. Without ijson the
+payload is decoded whole; run with --no-ijson to compare. Linux only.
+
+    python -m bench.bench_stream_memory [--no-ijson] [rows ...]
+"""
+import json
+import logging
+import subprocess
+import sys
+import time
+
+from tabulate import tabulate
+
+from tests.fakes import (FakeSC, FakeCoinDaemon, make_client, close_client,
+                         make_payouts)
+
+
+def peak_rss():
+    """ Peak RSS of this process in MB. Unlike ru_maxrss, VmHWM starts over
+    on exec, so it doesn't include the parent's memory at fork """
+    for line in open('/proc/self/status'):
+        if line.startswith('VmHWM'):
+            return int(line.split()[1]) / 1024.0
+
+
+def child(url, rows, use_ijson):
+    from simplecoin_rpc_client import sc_rpc
+    if not use_ijson:
+        sc_rpc.ijson = None
+
+    class SC(object):
+        pass
+    sc = SC()
+    sc.url = url
+    daemon = FakeCoinDaemon().start()
+    client = make_client(sc, daemon, incremental_pull=False)
+    start = time.time()
+    try:
+        client.pull_payouts()
+    finally:
+        close_client(client)
+        daemon.stop()
+    print(json.dumps({'rows': rows, 'seconds': time.time() - start,
+                      'peak_mb': peak_rss()}))
+
+
+def run(rows, use_ijson):
+    sc = FakeSC(make_payouts(rows, addresses=min(rows, 20000))).start()
+    try:
+        out = subprocess.check_output(
+            [sys.executable, '-m', 'bench.bench_stream_memory', '--child',
+             sc.url, str(rows), '1' if use_ijson else '0'])
+    finally:
+        sc.stop()
+    return json.loads(out.splitlines()[-1])
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(sys.argv[2], int(sys.argv[3]), sys.argv[4] == '1')
+
+    logging.basicConfig(level=logging.WARN)
+    args = sys.argv[1:]
+    use_ijson = '--no-ijson' not in args
+    sizes = [int(arg) for arg in args if arg != '--no-ijson']
+    results = [run(rows, use_ijson) for rows in sizes or [10000, 100000, 500000]]
+    print(tabulate([(r['rows'], r['seconds'], r['peak_mb']) for r in results],
+                   headers=["Rows", "Pull (s)", "Peak RSS (MB)"],
+                   tablefmt="grid", floatfmt=".1f"))
+
+
+if __name__ == "__main__":
+    main()
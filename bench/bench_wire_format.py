@@ -0,0 +1,70 @@
+""" JSON vs msgpack payload encoding, for a get_payouts response and an
+associate_payouts post of N items. Times dumps and loads of the bare
+payload and of the signed value sent on the wire. Needs msgpack. Its pure
+Python fallback is much slower than its C extension, so check which one ran.
+
+    python -m bench.bench_wire_format [items ...]
+"""
+import sys
+import time
+
+from itsdangerous import TimedSerializer
+from tabulate import tabulate
+
+from simplecoin_rpc_client.transport import MsgpackPayload, msgpack
+from tests.fakes import SECRET, make_payouts
+
+
+def best_of(func, runs=5):
+    times = []
+    for _ in xrange(runs):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def measure(serializer, obj):
+    """ (size, dumps seconds, loads seconds) for the bare payload and the
+    signed value """
+    payload = serializer.serializer
+    raw = payload.dumps(obj)
+    signed = serializer.dumps(obj)
+    return ((len(raw), best_of(lambda: payload.dumps(obj)),
+             best_of(lambda: payload.loads(raw))),
+            (len(signed), best_of(lambda: serializer.dumps(obj)),
+             best_of(lambda: serializer.loads(signed))))
+
+
+def main():
+    if msgpack is None:
+        sys.exit("msgpack isn't installed")
+    serializers = [('json', TimedSerializer(SECRET)),
+                   ('msgpack', TimedSerializer(SECRET, serializer=MsgpackPayload))]
+    rows = []
+    for count in [int(arg) for arg in sys.argv[1:]] or [100000]:
+        payloads = [
+            ('get_payouts', {'pids': make_payouts(count,
+                                                  addresses=min(count, 20000))}),
+            ('associate_payouts', {'coin_txid': 'a' * 64, 'tx_fee': 0.0001,
+                                   'currency': 'TST',
+                                   'pids': ['pid{}'.format(i)
+                                            for i in xrange(count)]})]
+        for name, obj in payloads:
+            for wire_format, serializer in serializers:
+                bare, signed = measure(serializer, obj)
+                rows.append((name, count, wire_format) + bare + signed)
+
+    implementation = ('pure Python fallback'
+                      if msgpack.Packer.__module__ == 'msgpack.fallback'
+                      else 'C extension')
+    print("msgpack {} ({})".format(
+        '.'.join(str(part) for part in msgpack.version), implementation))
+    print(tabulate(rows, headers=["Payload", "Items", "Format", "Bytes",
+                                  "dumps (s)", "loads (s)", "Signed bytes",
+                                  "Signed dumps (s)", "Signed loads (s)"],
+                   tablefmt="grid", floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,9 @@ setup(name='simplecoin_rpc_client',
       entry_points={
           'console_scripts': [
               'simplecoin_rpc_scheduler = simplecoin_rpc_client.scheduler:entry',
-              'simplecoin_rpc = simplecoin_rpc_client.manage:entry'
+              'simplecoin_rpc = simplecoin_rpc_client.manage:entry',
+              'simplecoin_blocknotify = simplecoin_rpc_client.blocknotify:entry'
           ]
       },
-      packages=find_packages()
+      packages=find_packages(exclude=['tests', 'tests.*', 'bench', 'bench.*'])
       )
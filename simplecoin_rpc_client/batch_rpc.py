@@ -0,0 +1,152 @@
+import functools
+import inspect
+import itertools
+import json
+import logging
+import requests
+
+from cryptokit.rpc import CoinRPCException
+from decimal import Decimal
+from requests.exceptions import RequestException
+
+
+class BatchRPCError(Exception):
+    pass
+
+
+class CoinRPCCircuitOpen(CoinRPCException):
+    """ The coinserver's circuit is open, so the call was never sent """
+    pass
+
+
+class BatchRPC(object):
+    """ Sends JSON-RPC calls to the coinserver of a CoinRPC wrapper as batch
+    requests, so N lookups cost N / batch_size round trips instead of N. A
+    failed call only fails its own entry, never the rest of the batch. """
+
+    def __init__(self, coin_rpc, batch_size=100, timeout=30, logger=None,
+                 breaker=None):
+        coinserv = coin_rpc.coinserv
+        self.url = "http://{}:{}/".format(coinserv['address'], coinserv['port'])
+        self.auth = (coinserv['username'], coinserv['password'])
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self.session = requests.Session()
+        self.breaker = breaker
+        self._ids = itertools.count()
+
+    def call(self, method, *params):
+        """ Makes a single call, raising BatchRPCError on failure """
+        (result, error), = self.call_many(method, [params])
+        if error is not None:
+            raise BatchRPCError(error)
+        return result
+
+    def call_many(self, method, params_list):
+        """ Calls method once for each tuple of params. Returns a list of
+        (result, error) pairs in the same order, where error is None on
+        success """
+        return self.batch([(method, params) for params in params_list])
+
+    def batch(self, calls):
+        """ Sends a list of (method, params) calls, batch_size at a time.
+        Returns a list of (result, error) pairs in the same order """
+        calls = list(calls)
+        results = []
+        for i in xrange(0, len(calls), self.batch_size):
+            results.extend(self._send(calls[i:i + self.batch_size]))
+        return results
+
+    def _send(self, calls):
+        requests_by_id = {}
+        payload = []
+        for method, params in calls:
+            call_id = next(self._ids)
+            requests_by_id[call_id] = len(payload)
+            payload.append({'version': '1.1', 'method': method,
+                            'params': list(params), 'id': call_id})
+
+        if self.breaker and not self.breaker.allow():
+            return [(None, {'code': -1, 'message': 'Circuit to {} is open'
+                            .format(self.breaker.name)})] * len(calls)
+        try:
+            ret = self.session.post(self.url, data=json.dumps(payload),
+                                    auth=self.auth, timeout=self.timeout,
+                                    headers={'Content-Type': 'application/json'})
+            responses = ret.json(parse_float=Decimal)
+        except (RequestException, ValueError) as e:
+            if self.breaker:
+                self.breaker.failure()
+            self.logger.warn("Batch of {:,} coinserver calls failed: {}"
+                             .format(len(calls), e))
+            return [(None, {'code': -1, 'message': str(e)})] * len(calls)
+        if self.breaker:
+            self.breaker.success()
+
+        # Daemons without batch support answer with a single error object
+        if not isinstance(responses, list):
+            error = responses.get('error') if isinstance(responses, dict) else None
+            error = error or {'code': -1, 'message': 'Invalid batch response'}
+            return [(None, error)] * len(calls)
+
+        results = [(None, {'code': -1, 'message': 'No response'})] * len(calls)
+        for response in responses:
+            index = requests_by_id.get(response.get('id'))
+            if index is not None:
+                results[index] = (response.get('result'), response.get('error'))
+        return results
+
+    def get_transactions(self, txids):
+        """ Looks up a list of wallet transactions. Returns a dict of txid ->
+        gettransaction result, leaving out (and logging) any that failed """
+        txids = list(txids)
+        transactions = {}
+        for txid, (result, error) in zip(
+                txids, self.call_many('gettransaction', [(t, ) for t in txids])):
+            if error is not None or result is None:
+                self.logger.warn("Failed looking up transaction {}: {}"
+                                 .format(txid, error))
+                continue
+            transactions[txid] = result
+        return transactions
+
+
+class BreakerCoinRPC(object):
+    """ Wraps a CoinRPC so its method calls go through a CircuitBreaker.
+    While the circuit is open calls raise CoinRPCCircuitOpen, a
+    CoinRPCException every caller already handles, without touching the
+    daemon. Only poke_rpc failures and errors other than CoinRPCException
+    count against the daemon, since a CoinRPCException from any other call
+    (eg. insufficient funds) means the daemon answered. Attributes that
+    aren't methods pass through. """
+
+    def __init__(self, coin_rpc, breaker):
+        self._coin_rpc = coin_rpc
+        self.breaker = breaker
+
+    def __getattr__(self, name):
+        attr = getattr(self._coin_rpc, name)
+        if not inspect.ismethod(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def guarded(*args, **kwargs):
+            if not self.breaker.allow():
+                raise CoinRPCCircuitOpen({'code': -1, 'message':
+                                          'Circuit to {} is open'
+                                          .format(self.breaker.name)})
+            try:
+                result = attr(*args, **kwargs)
+            except CoinRPCException:
+                if name == 'poke_rpc':
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                raise
+            except Exception:
+                self.breaker.failure()
+                raise
+            self.breaker.success()
+            return result
+        return guarded
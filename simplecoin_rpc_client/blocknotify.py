@@ -0,0 +1,140 @@
+import argparse
+import logging
+import threading
+import requests
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urlparse import urljoin
+
+
+logger = logging.getLogger('apscheduler.scheduler')
+
+
+class CoalescingJob(object):
+    """ Runs a function some seconds after it's triggered. Triggers that come
+    in while a run is pending are merged into it, and triggers that come in
+    while it's running cause exactly one more run afterwards. A burst of
+    blocks therefore costs one run (or two, if it straddles a run). """
+
+    def __init__(self, name, func, delay):
+        self.name = name
+        self.func = func
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pending = False
+        self._running = False
+        self._rerun = False
+
+    def trigger(self):
+        with self._lock:
+            if self._pending:
+                return
+            if self._running:
+                self._rerun = True
+                return
+            self._pending = True
+        self._schedule()
+
+    def _schedule(self):
+        timer = threading.Timer(self.delay, self._run)
+        timer.daemon = True
+        timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._pending = False
+            self._running = True
+        try:
+            self.func()
+        except Exception:
+            logger.error("Unhandled exception in {} block job".format(self.name),
+                         exc_info=True)
+        finally:
+            with self._lock:
+                self._running = False
+                rerun, self._rerun = self._rerun, False
+                if rerun:
+                    self._pending = True
+            if rerun:
+                self._schedule()
+
+
+class BlockNotifyHandler(BaseHTTPRequestHandler):
+    """ Accepts GET or POST /<currency_code>[/<block hash>] """
+
+    def _handle(self):
+        parts = [p for p in self.path.split('?')[0].split('/') if p]
+        job = self.server.jobs.get(parts[0]) if parts else None
+        if job is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        logger.debug("Got block notification {}".format(self.path))
+        job.trigger()
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write("ok")
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        logger.debug("blocknotify: " + format % args)
+
+
+class BlockNotifyServer(ThreadingMixIn, HTTPServer):
+    """ Listens for notifications from the coin daemons' -blocknotify scripts
+    and runs confirm_trans and associate_all for the matching currency """
+    daemon_threads = True
+
+    def __init__(self, sc_rpc, host='127.0.0.1', port=9450, debounce=10):
+        HTTPServer.__init__(self, (host, port), BlockNotifyHandler)
+        self.jobs = {}
+        for currency, client in sc_rpc.iteritems():
+            self.jobs[currency] = CoalescingJob(currency,
+                                                self._job(client), debounce)
+
+    @staticmethod
+    def _job(client):
+        def job():
+            client.confirm_trans()
+            client.associate_all()
+        return job
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever,
+                                  name='blocknotify')
+        thread.daemon = True
+        thread.start()
+        logger.info("Listening for block notifications on {}:{}"
+                    .format(*self.server_address))
+        return thread
+
+
+def notify(url, currency, block_hash=''):
+    """ Tells a BlockNotifyServer at url that currency has a new block """
+    ret = requests.post(urljoin(url, '{}/{}'.format(currency, block_hash)),
+                        timeout=10)
+    ret.raise_for_status()
+
+
+def entry():
+    """
+    Call from the coin daemon's -blocknotify, or by hand to simulate a block
+
+    Eg.
+    litecoind -blocknotify="simplecoin_blocknotify -c LTC %s"
+    """
+    parser = argparse.ArgumentParser(prog='simplecoin block notifier')
+    parser.add_argument('-c', '--currencycode', required=True)
+    parser.add_argument('-u', '--url', default='http://127.0.0.1:9450/')
+    parser.add_argument('block_hash', nargs='?', default='')
+    args = parser.parse_args()
+
+    notify(args.url, args.currencycode, args.block_hash)
+
+
+if __name__ == "__main__":
+    entry()
@@ -0,0 +1,130 @@
+import math
+import time
+
+from collections import namedtuple
+from decimal import Decimal
+
+from simplecoin_rpc_client.batch_rpc import BatchRPCError
+
+
+# Rough serialized sizes in bytes of the parts of a transaction
+TX_OVERHEAD_SIZE = 10
+INPUT_SIZE = 148
+P2PKH_OUTPUT_SIZE = 34
+P2SH_OUTPUT_SIZE = 32
+# We assume every transaction gets a change output
+CHANGE_OUTPUT_SIZE = P2PKH_OUTPUT_SIZE
+
+
+PlannedTx = namedtuple('PlannedTx', ['addresses', 'amount', 'inputs', 'size', 'fee'])
+
+
+class PayoutPlanner(object):
+    """ Splits aggregated payout outputs into sendmany transactions. Sizes are
+    estimated from the output types and the number of inputs the wallet will
+    likely need, and priced with a cached fee rate from the coinserver.
+
+    Every transaction pays a fixed overhead (version, locktime, change output
+    and at least one input) on top of its outputs, so total fees are lowest
+    with the fewest transactions. Batches are filled greedily in address
+    order up to max_tx_size and the output limit, which gives the fewest
+    batches that keep each one a contiguous address range. """
+
+    def __init__(self, batch_rpc, config, logger, address_version):
+        self.batch_rpc = batch_rpc
+        self.config = config
+        self.logger = logger
+        self.address_version = address_version
+        self._fee_rate = None
+        self._utxo_value = None
+
+    def _cached(self, attr, fetch):
+        cached = getattr(self, attr)
+        if cached and time.time() - cached[0] < self.config['fee_estimate_ttl']:
+            return cached[1]
+        value = fetch()
+        setattr(self, attr, (time.time(), value))
+        return value
+
+    def fee_rate(self):
+        """ Fee per kB in coins. Uses the daemon's estimatefee when it has an
+        estimate, never going below the configured tx_fee """
+        return self._cached('_fee_rate', self._fetch_fee_rate)
+
+    def _fetch_fee_rate(self):
+        floor = Decimal(str(self.config['tx_fee'] or self.config['default_fee_rate']))
+        try:
+            estimate = self.batch_rpc.call('estimatefee',
+                                           self.config['fee_estimate_blocks'])
+        except BatchRPCError as e:
+            self.logger.warn("Unable to estimate {} fee rate, using {}/kB: {}"
+                             .format(self.config['currency_code'], floor, e))
+            return floor
+        # -1 means the daemon doesn't have enough data yet
+        if estimate is None or estimate < 0:
+            return floor
+        return max(Decimal(str(estimate)), floor)
+
+    def utxo_value(self):
+        """ Average value of the wallet's unspent outputs in base units, used
+        to guess how many inputs a transaction needs. None if unknown """
+        return self._cached('_utxo_value', self._fetch_utxo_value)
+
+    def _fetch_utxo_value(self):
+        try:
+            unspent = self.batch_rpc.call('listunspent')
+        except BatchRPCError as e:
+            self.logger.warn("Unable to list {} unspent outputs: {}"
+                             .format(self.config['currency_code'], e))
+            return None
+        if not unspent:
+            return None
+        total = sum(Decimal(str(u['amount'])) for u in unspent)
+        return int(total * 100000000 / len(unspent)) or None
+
+    def expected_inputs(self, amount):
+        utxo_value = self.utxo_value()
+        if not utxo_value:
+            return self.config['expected_inputs']
+        return max(1, int(math.ceil(float(amount) / utxo_value)))
+
+    def output_size(self, address):
+        if self.address_version(address) in self.config['p2sh_address_versions']:
+            return P2SH_OUTPUT_SIZE
+        return P2PKH_OUTPUT_SIZE
+
+    def tx_size(self, outputs_size, inputs):
+        return (TX_OVERHEAD_SIZE + CHANGE_OUTPUT_SIZE + outputs_size +
+                inputs * INPUT_SIZE)
+
+    def tx_fee(self, size):
+        return (self.fee_rate() * size / 1000).quantize(Decimal('0.00000001'))
+
+    def _planned(self, addresses, amount, outputs_size):
+        inputs = self.expected_inputs(amount)
+        size = self.tx_size(outputs_size, inputs)
+        return PlannedTx(addresses, amount, inputs, size, self.tx_fee(size))
+
+    def plan(self, amounts, output_limit):
+        """ Given an ordered mapping of address -> amount in base units,
+        returns a list of PlannedTx """
+        planned = []
+        addresses = []
+        amount = 0
+        outputs_size = 0
+        for address, value in amounts.iteritems():
+            size = self.output_size(address)
+            if addresses:
+                inputs = self.expected_inputs(amount + value)
+                too_big = (self.tx_size(outputs_size + size, inputs) >
+                           self.config['max_tx_size'])
+                if too_big or len(addresses) >= output_limit:
+                    planned.append(self._planned(addresses, amount, outputs_size))
+                    addresses, amount, outputs_size = [], 0, 0
+            addresses.append(address)
+            amount += value
+            outputs_size += size
+
+        if addresses:
+            planned.append(self._planned(addresses, amount, outputs_size))
+        return planned
@@ -5,40 +5,137 @@ import yaml
 import os
 import argparse
 import datetime
-import requests
+import hmac
+import tempfile
+import threading
+import time
+import uuid
 import sqlalchemy as sa
 import decorator
 
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from decimal import Decimal, ROUND_HALF_UP
+
 from cryptokit.rpc import CoinRPCException
 from urllib3.exceptions import ConnectionError
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
 from tabulate import tabulate
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from urlparse import urljoin
 from cryptokit.base58 import get_bcaddress_version
-from itsdangerous import TimedSerializer, BadData
+from simplecoin_rpc_client.batch_rpc import (BatchRPC, BreakerCoinRPC,
+                                             CoinRPCCircuitOpen)
+from simplecoin_rpc_client.planner import PayoutPlanner
+from simplecoin_rpc_client.transport import (get_session, connection_stats,
+                                             gzip_compress, RetryPolicy,
+                                             MsgpackPayload, msgpack,
+                                             get_breaker, breaker_states,
+                                             ItemStream, LimitedReader, ijson)
+from itsdangerous import (TimedSerializer, BadData, BadSignature,
+                          SignatureExpired, want_bytes, base64_encode,
+                          base64_decode, bytes_to_int, constant_time_compare)
 
 
 base = declarative_base()
 
+# Base units (satoshis) per coin
+COIN = 100000000
+
+
+def to_base_units(amount):
+    """ Converts a coin amount (str, float or Decimal) to an integer number of
+    base units, rounding to the nearest unit """
+    return int((Decimal(str(amount)) * COIN)
+               .to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_base_units(amount):
+    """ Converts an integer number of base units to an exact Decimal amount """
+    return (Decimal(amount) / COIN).quantize(Decimal(1) / COIN)
+
+
+def chunks(lst, size):
+    """ Yields successive slices of lst that are at most size long """
+    for i in xrange(0, len(lst), size):
+        yield lst[i:i + size]
+
+
+class LRUCache(object):
+    """ A minimal bounded mapping that evicts the least recently used key and
+    counts hits and misses """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data[key] = value
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
 
 @decorator.decorator
 def crontab(func, *args, **kwargs):
     """ Handles rolling back SQLAlchemy exceptions to prevent breaking the
     connection for the whole scheduler. Also records timing information into
-    the cache """
+    the cache. SC calls made by the job are bound by its job_deadlines entry,
+    if it has one.
+
+    Jobs share the client's session, and are called from the scheduler's
+    pool and the blocknotify timers, so they run one at a time per client.
+    The outermost job closes the session when it's done, so the next job
+    (maybe on another thread) starts with a fresh connection. """
     self = args[0]
 
     res = None
-    try:
-        res = func(*args, **kwargs)
-    except sa.exc.SQLAlchemyError:
-        self.logger.error("SQLAlchemyError occurred, rolling back", exc_info=True)
-        self.db.session.rollback()
-    except Exception:
-        self.logger.error("Unhandled exception in {}".format(func.__name__),
-                          exc_info=True)
+    seconds = self.config['job_deadlines'].get(func.__name__)
+    with self._job_lock:
+        depth = getattr(self._local, 'job_depth', 0)
+        self._local.job_depth = depth + 1
+        try:
+            with self._deadline(time.time() + seconds if seconds else None):
+                res = func(*args, **kwargs)
+        except SCRPCDeadlineExceeded as e:
+            self.logger.warn("{} ran out of time: {}".format(func.__name__, e))
+        except SC_UNREACHABLE as e:
+            self.logger.warn("{} unable to connect to SC: {}"
+                             .format(func.__name__, e))
+        except sa.exc.SQLAlchemyError:
+            self.logger.error("SQLAlchemyError occurred, rolling back",
+                              exc_info=True)
+            try:
+                self.db.session.rollback()
+            except sa.exc.SQLAlchemyError:
+                self.logger.error("Rollback failed", exc_info=True)
+        except Exception:
+            self.logger.error("Unhandled exception in {}".format(func.__name__),
+                              exc_info=True)
+        finally:
+            self._local.job_depth = depth
+            if not depth:
+                self.db.session.close()
 
     return res
 
@@ -53,6 +150,9 @@ class Payout(base):
     address = sa.Column(sa.String, nullable=False)
     # SQLlite does not have support for Decimal - use STR instead
     amount = sa.Column(sa.String, nullable=False)
+    # The same amount in integer base units, for exact arithmetic. Nullable
+    # only because sqlite can't add a NOT NULL column to an existing table
+    amount_int = sa.Column(sa.BigInteger)
     currency_code = sa.Column(sa.String, nullable=False)
     txid = sa.Column(sa.String)
     associated = sa.Column(sa.Boolean, default=False, nullable=False)
@@ -78,10 +178,79 @@ class Payout(base):
         return [getattr(self, a) for a in columns]
 
 
+class AddressVersion(base):
+    """ Persisted address version lookups, so the in memory cache starts warm
+    after a restart. A NULL version means the address failed to decode. """
+    __tablename__ = "address_versions"
+    address = sa.Column(sa.String, primary_key=True)
+    version = sa.Column(sa.Integer)
+
+
+class Transaction(base):
+    """ Details of the transactions paying out our payouts, recorded when we
+    send them (or the first time we look them up) so the wallet doesn't need
+    to be asked again """
+    __tablename__ = "transactions"
+    txid = sa.Column(sa.String, primary_key=True)
+    currency_code = sa.Column(sa.String, nullable=False)
+    # Fee in base units as reported by the wallet
+    fee = sa.Column(sa.BigInteger)
+    output_count = sa.Column(sa.Integer)
+    total_amount = sa.Column(sa.BigInteger)
+    sent_time = sa.Column(sa.DateTime)
+    # Set once we've seen min_confirms confirmations
+    confirmed = sa.Column(sa.Boolean, default=False, nullable=False)
+    # The block that mined the transaction, recorded the first time we see
+    # it mined. Confirmations are then just tip - block_height + 1
+    block_hash = sa.Column(sa.String)
+    block_height = sa.Column(sa.Integer)
+
+
+class PullState(base):
+    """ Remembers the high-water mark SC gave us on the last payout pull so
+    the next pull only needs to transfer payouts created since then """
+    __tablename__ = "pull_state"
+    currency_code = sa.Column(sa.String, primary_key=True)
+    # Opaque to us, SC decides whether it's a pid or a timestamp
+    cursor = sa.Column(sa.String)
+    update_time = sa.Column(sa.DateTime)
+
+
 class SCRPCException(Exception):
     pass
 
 
+class SCRPCServerError(SCRPCException):
+    """ A 5xx from SC, which is worth retrying """
+    pass
+
+
+class SCRPCCircuitOpen(SCRPCException):
+    """ SC has been failing, so the call wasn't attempted """
+    pass
+
+
+class SCRPCDeadlineExceeded(SCRPCException):
+    """ The job's deadline (see job_deadlines) ran out before the SC call
+    was made or finished """
+    pass
+
+
+# SC couldn't be reached, even after retries. Worth a warning, not a
+# traceback every run
+SC_UNREACHABLE = (ConnectionError, RequestsConnectionError, Timeout,
+                  SCRPCCircuitOpen)
+
+
+class PayoutBatchFailed(Exception):
+    """ A payout transaction wasn't sent. locked says whether its payouts
+    were left locked, because we can't tell whether the wallet sent it """
+
+    def __init__(self, locked):
+        Exception.__init__(self, locked)
+        self.locked = locked
+
+
 class SCRPCClient(object):
     def _set_config(self, **kwargs):
         # A fast way to set defaults for the kwargs then set them as attributes
@@ -92,7 +261,86 @@ class SCRPCClient(object):
                            database_path=base + '/rpc_',
                            log_path=base + '/sc_rpc.log',
                            min_confirms=12,
-                           minimum_tx_output=0.00000001)
+                           minimum_tx_output=0.00000001,
+                           # Max bound parameters per statement. sqlite's
+                           # default SQLITE_MAX_VARIABLE_NUMBER is 999
+                           sql_chunk_size=500,
+                           # Send SC the cursor from our last pull so it only
+                           # returns newer payouts
+                           incremental_pull=True,
+                           # Streamed responses are read in chunks of this
+                           # size, and spooled to disk past stream_spool_size
+                           stream_chunk_size=65536,
+                           stream_spool_size=8 * 1024 * 1024,
+                           # Number of address -> version lookups to memoize
+                           address_cache_size=50000,
+                           persist_address_cache=False,
+                           # Payout transaction planning. tx_fee is a minimum
+                           # fee rate per kB, default_fee_rate is used when
+                           # tx_fee is 0 and the daemon can't estimate
+                           tx_fee=0,
+                           default_fee_rate=0.0001,
+                           fee_estimate_blocks=6,
+                           fee_estimate_ttl=600,
+                           max_tx_size=95000,
+                           expected_inputs=1,
+                           p2sh_address_versions=[5, 196, 50, 58],
+                           # Calls per JSON-RPC batch request to the coinserver
+                           coinserv_batch_size=100,
+                           coinserv_timeout=30,
+                           # associate_payouts posts at most this many pids,
+                           # using up to associate_threads concurrent posts
+                           associate_chunk_size=5000,
+                           associate_threads=4,
+                           # Unconfirmed transactions are fetched from SC
+                           # api_page_size at a time, up to api_max_pages, and
+                           # confirmed back confirm_post_size at a time
+                           api_page_size=500,
+                           api_max_pages=100,
+                           confirm_post_size=500,
+                           # Max keep-alive connections per host for the
+                           # process wide HTTP session
+                           http_pool_size=10,
+                           # Retries of failed SC calls. See RetryPolicy
+                           retry_attempts=4,
+                           retry_backoff=0.5,
+                           retry_max_backoff=30,
+                           retry_deadline=300,
+                           retry_budget=20,
+                           retry_budget_window=60,
+                           # Posts that change state on SC. These carry an
+                           # Idempotency-Key header so a retry can't apply
+                           # them twice
+                           idempotent_key_posts=['associate_payouts',
+                                                 'confirm_transactions',
+                                                 'update_trade_requests'],
+                           # gzip signed request bodies of at least
+                           # compress_min_size bytes. SC must accept
+                           # Content-Encoding: gzip bodies
+                           compress_requests=False,
+                           compress_min_size=1024,
+                           # endpoint -> payload encoding for signed calls,
+                           # 'json' (the default) or 'msgpack'
+                           wire_formats={},
+                           # Defaults for every SC endpoint, overridden per
+                           # endpoint in endpoints. See _endpoint_config
+                           connect_timeout=10,
+                           read_timeout=270,
+                           max_request_size=None,
+                           max_response_size=None,
+                           endpoints={},
+                           # job name -> seconds all of the job's SC calls,
+                           # including retries, must finish within
+                           job_deadlines={},
+                           # Warn when a response's signature has used up
+                           # this fraction of its max_age
+                           signature_age_warn=0.8,
+                           # Consecutive connection failures, timeouts or 5xx
+                           # before calls to SC (or the coinserver) fail fast,
+                           # and seconds before a probe call is let through.
+                           # Shared per remote, the first client's settings win
+                           breaker_threshold=5,
+                           breaker_cooldown=60)
         self.config.update(kwargs)
 
         # Kinda sloppy, but it works
@@ -133,15 +381,23 @@ class SCRPCClient(object):
 
         @sa.event.listens_for(self.engine, "begin")
         def do_begin(conn):
-            # emit our own BEGIN
-            conn.execute("BEGIN EXCLUSIVE")
+            # emit our own BEGIN. Exclusive unless the connection came from
+            # read_engine
+            conn.execute("BEGIN " + conn._execution_options.get('sqlite_begin',
+                                                                  'EXCLUSIVE'))
+
+        # For read only work that shouldn't block other jobs. A deferred
+        # transaction only takes a shared lock while it reads
+        self.read_engine = self.engine.execution_options(sqlite_begin='DEFERRED')
+        # action -> (count, total seconds, max seconds) exclusive lock held
+        self.lock_stats = {}
 
         self.db = sessionmaker(bind=self.engine)
         self.db.session = self.db()
         # Hack if flask is in the env
         self.db.session._model_changes = {}
-        # Create the table if it doesn't exist
-        Payout.__table__.create(self.engine, checkfirst=True)
+        # Create the tables if they don't exist
+        base.metadata.create_all(self.engine, checkfirst=True)
 
         # Setup logger for the class
         if logger:
@@ -166,35 +422,547 @@ class SCRPCClient(object):
                 self.logger.addHandler(handler)
 
         self.serializer = TimedSerializer(self.config['rpc_signature'])
+        self.serializers = {'json': self.serializer}
+        for endpoint, wire_format in self.config['wire_formats'].iteritems():
+            if wire_format not in ('json', 'msgpack'):
+                raise SCRPCException('Unknown wire format {} for {}'
+                                     .format(wire_format, endpoint))
+        if 'msgpack' in self.config['wire_formats'].values():
+            if msgpack is None:
+                raise SCRPCException('msgpack wire format configured but the '
+                                     'msgpack package is not installed')
+            self.serializers['msgpack'] = TimedSerializer(
+                self.config['rpc_signature'], serializer=MsgpackPayload)
+        if ijson is None and \
+                self.config['wire_formats'].get('get_payouts', 'json') == 'json':
+            self.logger.warn("ijson isn't installed, so get_payouts responses "
+                             "are decoded whole instead of streamed. Memory "
+                             "use will grow with the size of each pull.")
+        self.session = get_session(self.config['http_pool_size'])
+        self._local = threading.local()
+        # Held by every crontab job, see crontab
+        self._job_lock = threading.RLock()
+        # endpoint -> [responses, expired, total age, max age / max_age]
+        self.signature_ages = {}
+        self._signature_lock = threading.Lock()
+        self.retry = RetryPolicy(attempts=self.config['retry_attempts'],
+                                 backoff=self.config['retry_backoff'],
+                                 max_backoff=self.config['retry_max_backoff'],
+                                 deadline=self.config['retry_deadline'],
+                                 budget=self.config['retry_budget'],
+                                 budget_window=self.config['retry_budget_window'],
+                                 logger=self.logger)
+        # Fail fast while SC or the coinserver is down
+        self.breaker = get_breaker(self.config['rpc_url'],
+                                   self.config['breaker_threshold'],
+                                   self.config['breaker_cooldown'], self.logger)
+        coinserv = CoinRPC.coinserv
+        self.coin_rpc = BreakerCoinRPC(CoinRPC, get_breaker(
+            "coinserver {}:{}".format(coinserv['address'], coinserv['port']),
+            self.config['breaker_threshold'], self.config['breaker_cooldown'],
+            self.logger))
+        self._migrate()
+
+        self.batch_rpc = BatchRPC(self.coin_rpc,
+                                  batch_size=self.config['coinserv_batch_size'],
+                                  timeout=self.config['coinserv_timeout'],
+                                  logger=self.logger,
+                                  breaker=self.coin_rpc.breaker)
+        self.planner = PayoutPlanner(self.batch_rpc, self.config, self.logger,
+                                     self.address_version)
+
+        self.address_cache = LRUCache(self.config['address_cache_size'])
+        self._unsaved_versions = {}
+        if self.config['persist_address_cache']:
+            self._load_address_cache()
 
     ########################################################################
     # Helper URL methods
     ########################################################################
     def post(self, url, *args, **kwargs):
-        if 'data' not in kwargs:
-            kwargs['data'] = ''
-        kwargs['data'] = self.serializer.dumps(kwargs['data'])
-        return self.remote('/rpc/' + url, 'post', *args, **kwargs)
+        kwargs['payload'] = kwargs.pop('data', '')
+        headers = kwargs.setdefault('headers', {})
+        if url in self.config['idempotent_key_posts']:
+            # One key per logical call, shared by all of its retries
+            headers['Idempotency-Key'] = uuid.uuid4().hex
+        wire_format = self.config['wire_formats'].get(url, 'json')
+        kwargs['serializer'] = self.serializers[wire_format]
+        if wire_format != 'json':
+            # Same format both ways
+            headers['Content-Type'] = MsgpackPayload.content_type
+            headers['Accept'] = MsgpackPayload.content_type
+        return self.remote('/rpc/' + url, 'post', *args, endpoint=url, **kwargs)
 
     def get(self, url, *args, **kwargs):
-        return self.remote(url, 'get', *args, **kwargs)
-
-    def remote(self, url, method, max_age=None, signed=True, **kwargs):
+        return self.remote(url, 'get', *args, endpoint=url.split('?')[0],
+                           **kwargs)
+
+    def _endpoint_config(self, endpoint):
+        """ Returns the timeouts, max_age and size limits for an endpoint.
+        Keys are the post name (eg. get_payouts) or the path of a get (eg.
+        api/transaction) """
+        conf = dict((key, self.config[key]) for key in
+                    ('connect_timeout', 'read_timeout', 'max_age',
+                     'max_request_size', 'max_response_size'))
+        conf.update(self.config['endpoints'].get(endpoint, {}))
+        return conf
+
+    @contextmanager
+    def _deadline(self, deadline):
+        """ Bounds SC calls made by this thread to finish by deadline (a
+        unix time, or None for no bound). Nested deadlines keep the earliest """
+        previous = getattr(self._local, 'deadline', None)
+        if previous is not None and (deadline is None or previous < deadline):
+            deadline = previous
+        self._local.deadline = deadline
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def _remaining(self):
+        """ Seconds left before this thread's deadline, or None """
+        deadline = getattr(self._local, 'deadline', None)
+        if deadline is None:
+            return None
+        return deadline - time.time()
+
+    def _check_deadline(self, endpoint, exc):
+        """ Raises SCRPCDeadlineExceeded if exc, a timeout or connection
+        error, came from reads cut short by this thread's deadline """
+        remaining = self._remaining()
+        if remaining is not None and remaining <= 0:
+            raise SCRPCDeadlineExceeded("Job deadline ran out waiting for {} "
+                                        "({})".format(endpoint, exc))
+
+    def _record_signature_age(self, endpoint, age, max_age, expired=False):
+        with self._signature_lock:
+            stats = self.signature_ages.setdefault(endpoint, [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += expired
+            stats[2] += age
+            stats[3] = max(stats[3], float(age) / max_age)
+        if not expired and age >= max_age * self.config['signature_age_warn']:
+            self.logger.warn("{} response signature was {:.1f}s old, max_age is "
+                             "{}s".format(endpoint, age, max_age))
+
+    @staticmethod
+    def _retryable(exc):
+        return isinstance(exc, (ConnectionError, RequestsConnectionError,
+                                Timeout, SCRPCServerError))
+
+    def remote(self, url, method, max_age=None, signed=True, payload=None,
+               serializer=None, endpoint=None, items=None, **kwargs):
+        endpoint = endpoint or url
+        conf = self._endpoint_config(endpoint)
+        max_age = max_age or conf['max_age']
         url = urljoin(self.config['rpc_url'], url)
-        self.logger.debug("Making request to {}".format(url))
-        ret = getattr(requests, method)(url, timeout=270, **kwargs)
-        if ret.status_code != 200:
-            raise SCRPCException("Non 200 from remote: {}".format(ret.text))
+        serializer = serializer or self.serializer
+
+        def attempt():
+            self.logger.debug("Making request to {}".format(url))
+            read_timeout = conf['read_timeout']
+            remaining = self._remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise SCRPCDeadlineExceeded("Job deadline passed before "
+                                                "calling {}".format(endpoint))
+                read_timeout = min(read_timeout, remaining)
+            if payload is not None:
+                # Signed per attempt so a retry doesn't carry a stale
+                # timestamp. The signature covers the uncompressed body
+                data = serializer.dumps(payload)
+                if (self.config['compress_requests'] and
+                        len(data) >= self.config['compress_min_size']):
+                    size = len(data)
+                    data = gzip_compress(data)
+                    kwargs.setdefault('headers', {})['Content-Encoding'] = 'gzip'
+                    self.logger.debug("Compressed {:,} byte request to {:,} bytes"
+                                      .format(size, len(data)))
+                if conf['max_request_size'] and len(data) > conf['max_request_size']:
+                    raise SCRPCException("{:,} byte {} request is over the {:,} "
+                                         "byte limit".format(len(data), endpoint,
+                                                             conf['max_request_size']))
+                kwargs['data'] = data
+            if not self.breaker.allow():
+                raise SCRPCCircuitOpen("Circuit to {} is open, not calling {}"
+                                       .format(self.breaker.name, endpoint))
+            try:
+                ret = getattr(self.session, method)(
+                    url, timeout=(conf['connect_timeout'], read_timeout), **kwargs)
+                if ret.status_code >= 500:
+                    raise SCRPCServerError("{} from remote: {}"
+                                           .format(ret.status_code, ret.text))
+            except Exception as e:
+                if self._retryable(e):
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                if isinstance(e, Timeout):
+                    # The read timeout is capped by the deadline
+                    self._check_deadline(endpoint, e)
+                raise
+            self.breaker.success()
+            if ret.status_code != 200:
+                raise SCRPCException("Non 200 from remote: {}".format(ret.text))
+            self._check_response_size(ret.headers.get('Content-Length'),
+                                      endpoint, conf)
+            return ret
+
+        ret = self.retry.call(attempt, self._retryable, name=url,
+                              deadline=self._remaining())
 
         try:
-            self.logger.debug("Got {} from remote".format(ret.text.encode('utf8')))
+            if signed and kwargs.get('stream'):
+                return self._loads_stream(ret, max_age, serializer, endpoint,
+                                          conf['max_response_size'], items)
+            self._check_response_size(len(ret.content), endpoint, conf)
+            if (self.logger.isEnabledFor(logging.DEBUG) and
+                    serializer.is_text_serializer):
+                self.logger.debug("Got {} from remote"
+                                  .format(ret.text[:1000].encode('utf8')))
             if signed:
-                return self.serializer.loads(ret.text, max_age or self.config['max_age'])
+                value, signed_time = serializer.loads(ret.content, max_age,
+                                                      return_timestamp=True)
+                self._record_signature_age(
+                    endpoint, (datetime.datetime.utcnow() - signed_time)
+                    .total_seconds(), max_age)
+                return value
             else:
                 return ret.json()
+        except SignatureExpired as e:
+            if e.date_signed is not None:
+                self._record_signature_age(
+                    endpoint, (datetime.datetime.utcnow() - e.date_signed)
+                    .total_seconds(), max_age, expired=True)
+            self.logger.error("Expired signature from {}: {}".format(endpoint, e))
+            raise SCRPCException("Invalid signature")
         except BadData:
             self.logger.error("Invalid data returned from remote!", exc_info=True)
             raise SCRPCException("Invalid signature")
+        except (ConnectionError, RequestsConnectionError, Timeout) as e:
+            # Reading the body is bound by the same capped read timeout
+            self._check_deadline(endpoint, e)
+            raise
+
+    def _check_response_size(self, size, endpoint, conf):
+        if size is not None and conf['max_response_size'] and \
+                int(size) > conf['max_response_size']:
+            raise SCRPCException("{:,} byte {} response is over the {:,} byte "
+                                 "limit".format(int(size), endpoint,
+                                                conf['max_response_size']))
+
+    def _loads_stream(self, ret, max_age, serializer=None, endpoint=None,
+                      max_size=None, items=None):
+        """ Verifies and decodes a signed response without ever holding the
+        raw body as text. The body is spooled as it arrives while the
+        signature is computed chunk by chunk, then only the payload is read
+        back for decoding. Same checks as TimedSerializer.loads.
+
+        With items, returns an ItemStream over the items array of the
+        payload instead. If ijson is installed the verified spool is then
+        parsed as the stream is iterated, so the payload is never in memory
+        as a whole. """
+        serializer = serializer or self.serializer
+        signer = serializer.make_signer()
+        sep = want_bytes(signer.sep)
+        mac = hmac.new(signer.derive_key(), digestmod=signer.digest_method)
+        # The trailing signature has a fixed length for a given digest, so
+        # hold that many bytes back from the MAC until we hit the end
+        trailer_len = len(sep) + len(base64_encode(mac.digest()))
+
+        spool = tempfile.SpooledTemporaryFile(
+            max_size=self.config['stream_spool_size'])
+        try:
+            tail = b''
+            received = 0
+            for chunk in ret.iter_content(self.config['stream_chunk_size']):
+                received += len(chunk)
+                if max_size and received > max_size:
+                    raise SCRPCException("{} response is over the {:,} byte "
+                                         "limit".format(endpoint, max_size))
+                tail += chunk
+                if len(tail) > trailer_len:
+                    body, tail = tail[:-trailer_len], tail[-trailer_len:]
+                    mac.update(body)
+                    spool.write(body)
+
+            if len(tail) != trailer_len or not tail.startswith(sep):
+                raise BadSignature('No "{}" found in value'.format(signer.sep))
+            if not constant_time_compare(base64_encode(mac.digest()),
+                                         tail[len(sep):]):
+                raise BadSignature('Signature does not match')
+
+            # Signed value is payload + sep + timestamp
+            size = spool.tell()
+            spool.seek(max(0, size - 32))
+            timestamp = spool.read().rsplit(sep, 1)
+            if len(timestamp) != 2:
+                raise BadSignature('Timestamp missing')
+            timestamp = timestamp[1]
+            signed_time = bytes_to_int(base64_decode(timestamp))
+            age = signer.get_timestamp() - signed_time
+            if age > max_age:
+                raise SignatureExpired('Signature age {} > {} seconds'
+                                       .format(age, max_age),
+                                       date_signed=signer.timestamp_to_datetime(
+                                           signed_time))
+            self._record_signature_age(endpoint, age, max_age)
+
+            self.logger.debug("Got {:,} byte signed response from remote"
+                              .format(size + len(tail)))
+            spool.seek(0)
+            payload_size = size - len(timestamp) - len(sep)
+            if items is None:
+                return serializer.load_payload(spool.read(payload_size))
+            if ijson is None or serializer.serializer is MsgpackPayload:
+                return ItemStream(items, serializer.load_payload(
+                    spool.read(payload_size)))
+            # The stream owns the spool from here
+            stream = ItemStream(items, fileobj=LimitedReader(spool, payload_size),
+                                close=spool.close)
+            spool = None
+            return stream
+        finally:
+            if spool is not None:
+                spool.close()
+
+    ########################################################################
+    # Local database helpers
+    ########################################################################
+    def _migrate(self):
+        """ Brings a database created by an older version up to date. Adds
+        any missing columns, then backfills amount_int from amount. """
+        with self.engine.begin() as conn:
+            for table in base.metadata.sorted_tables:
+                existing = set(row[1] for row in conn.execute(
+                    "PRAGMA table_info({})".format(table.name)))
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    self.logger.info("Adding column {} to table {}"
+                                     .format(column.name, table.name))
+                    conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(
+                        table.name, column.name,
+                        column.type.compile(dialect=self.engine.dialect)))
+
+            rows = conn.execute(sa.select([Payout.id, Payout.amount])
+                                .where(Payout.amount_int == None)).fetchall()
+            if rows:
+                self.logger.info("Backfilling integer amounts for {:,} payouts"
+                                 .format(len(rows)))
+                conn.execute(Payout.__table__.update()
+                             .where(Payout.id == sa.bindparam('_id'))
+                             .values(amount_int=sa.bindparam('_amount_int')),
+                             [dict(_id=id, _amount_int=to_base_units(amount))
+                              for id, amount in rows])
+
+    @contextmanager
+    def _write_txn(self, action):
+        """ Runs the body as one exclusive write transaction on the session,
+        committing at the end, and records how long the lock was held """
+        start = time.time()
+        try:
+            yield self.db.session
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            raise
+        finally:
+            held = time.time() - start
+            count, total, longest = self.lock_stats.get(action, (0, 0.0, 0.0))
+            self.lock_stats[action] = (count + 1, total + held, max(longest, held))
+            self.logger.debug("Held {} database lock for {:.3f}s to {}"
+                              .format(self.config['currency_code'], held, action))
+
+    def _update_ids(self, ids, **values):
+        """ Sets values on the payouts with the given ids with one UPDATE per
+        sql_chunk_size ids, instead of one per row. Doesn't commit. """
+        start = time.time()
+        updated = 0
+        for chunk in chunks(list(ids), self.config['sql_chunk_size']):
+            updated += self.db.session.execute(
+                Payout.__table__.update()
+                .where(Payout.id.in_(chunk))
+                .values(**values)).rowcount
+        self.logger.info("Updated {:,} {} payouts in {:.3f}s"
+                         .format(updated, self.config['currency_code'],
+                                 time.time() - start))
+        return updated
+
+    def _log_lock_stats(self):
+        for action, (count, total, longest) in sorted(self.lock_stats.iteritems()):
+            self.logger.info("{} database lock held to {} {:,} times, {:.3f}s "
+                             "total, {:.3f}s max"
+                             .format(self.config['currency_code'], action,
+                                     count, total, longest))
+
+    def _transaction_fees(self, txids, simulate=False):
+        """ Returns a dict of txid -> fee for the given txids. Fees come from
+        the transactions table, only txids missing from it are looked up from
+        the wallet (and recorded unless simulating). Txids that can't be found
+        are left out. Fees are positive, whatever sign they were recorded or
+        reported with (bitcoind's gettransaction reports them negative). """
+        fees = {}
+        for chunk in chunks(list(txids), self.config['sql_chunk_size']):
+            query = (self.db.session.query(Transaction.txid, Transaction.fee)
+                     .filter(Transaction.txid.in_(chunk),
+                             Transaction.fee != None))
+            fees.update((txid, from_base_units(abs(fee))) for txid, fee in query)
+        self.db.session.commit()
+
+        missing = [txid for txid in txids if txid not in fees]
+        if missing:
+            self.logger.info("Looking up {:,} transaction fees from the {} "
+                             "wallet".format(len(missing),
+                                             self.config['currency_code']))
+            found = self.batch_rpc.get_transactions(missing)
+            for txid, tx in found.iteritems():
+                fees[txid] = abs(tx.get('fee', 0))
+                if not simulate:
+                    self._record_transaction(txid,
+                                             fee=to_base_units(fees[txid]))
+            self.db.session.commit()
+        return fees
+
+    def _confirmations(self, txids, simulate=False):
+        """ Returns a dict of txid -> confirmations, or True for transactions
+        already confirmed locally. Txids that couldn't be looked up are left
+        out. Returns None if the chain tip can't be fetched.
+
+        Transactions with a recorded block only cost one getblockhash to make
+        sure that block is still in the main chain, sent in the same batch as
+        the getblockcount, so tracked transactions take one round trip no
+        matter how many there are. Only transactions without a recorded block
+        (or knocked out of it by a reorg) need a gettransaction. """
+        known = {}
+        for chunk in chunks(list(txids), self.config['sql_chunk_size']):
+            query = (self.db.session.query(Transaction.txid,
+                                           Transaction.confirmed,
+                                           Transaction.block_hash,
+                                           Transaction.block_height)
+                     .filter(Transaction.txid.in_(chunk)))
+            for txid, confirmed, block_hash, block_height in query:
+                known[txid] = (confirmed, block_hash, block_height)
+        self.db.session.commit()
+
+        confirmations = {}
+        tracked = {}
+        for txid, (confirmed, block_hash, block_height) in known.iteritems():
+            if confirmed:
+                confirmations[txid] = True
+            elif block_hash is not None and block_height is not None:
+                tracked[txid] = (block_hash, block_height)
+
+        heights = sorted(set(height for _, height in tracked.itervalues()))
+        results = self.batch_rpc.batch(
+            [('getblockcount', ())] + [('getblockhash', (h, )) for h in heights])
+        tip, error = results[0]
+        if error is not None:
+            self.logger.error("Unable to get the {} block count: {}"
+                              .format(self.config['currency_code'], error))
+            return None
+        main_chain = dict((h, block_hash) for h, (block_hash, _)
+                          in zip(heights, results[1:]))
+
+        updates = {}
+        for txid, (block_hash, height) in tracked.iteritems():
+            if main_chain.get(height) == block_hash:
+                confirmations[txid] = tip - height + 1
+            else:
+                self.logger.warn("Block {} containing txid {} is no longer at "
+                                 "height {}, looking it up again"
+                                 .format(block_hash, txid, height))
+                updates[txid] = dict(block_hash=None, block_height=None)
+
+        lookup = [txid for txid in txids if txid not in confirmations]
+        if lookup:
+            self.logger.debug("Connecting to coinserv to lookup confirms for "
+                              "{:,} transactions".format(len(lookup)))
+        for txid, tx in self.batch_rpc.get_transactions(lookup).iteritems():
+            confirmations[txid] = tx.get('confirmations', 0)
+            if tx.get('blockhash') and confirmations[txid] > 0:
+                # Could be off by one if a block arrived in between. If so the
+                # hash check on the next run catches it and we look again
+                updates[txid] = dict(block_hash=tx['blockhash'],
+                                     block_height=tip - confirmations[txid] + 1)
+
+        if updates and not simulate:
+            for txid, values in updates.iteritems():
+                self._record_transaction(txid, **values)
+            self.db.session.commit()
+
+        return confirmations
+
+    def _record_transaction(self, txid, **kwargs):
+        """ Creates or updates a transactions row. Doesn't commit. """
+        tx = self.db.session.query(Transaction).get(txid)
+        if tx is None:
+            tx = Transaction(txid=txid,
+                             currency_code=self.config['currency_code'])
+            self.db.session.add(tx)
+        for key, value in kwargs.iteritems():
+            setattr(tx, key, value)
+        return tx
+
+    def _existing_pids(self, pids):
+        """ Returns the subset of the given pids that are already stored
+        locally, querying in chunks to stay under sqlite's parameter limit """
+        existing = set()
+        for chunk in chunks(list(pids), self.config['sql_chunk_size']):
+            query = (self.db.session.query(Payout.pid)
+                     .filter(Payout.pid.in_(chunk)))
+            existing.update(pid for (pid, ) in query)
+        return existing
+
+    def address_version(self, address):
+        """ Memoized get_bcaddress_version. The same addresses come back on
+        every pull, so skip the base58 decode + checksum for known ones. """
+        version = self.address_cache.get(address, False)
+        if version is False:
+            version = get_bcaddress_version(address)
+            self.address_cache.set(address, version)
+            if self.config['persist_address_cache']:
+                self._unsaved_versions[address] = version
+        return version
+
+    def _load_address_cache(self):
+        query = (self.db.session.query(AddressVersion.address,
+                                       AddressVersion.version)
+                 .limit(self.config['address_cache_size']))
+        for address, version in query:
+            self.address_cache.set(address, version)
+        self.db.session.commit()
+        self.logger.debug("Loaded {:,} cached address versions"
+                          .format(len(self.address_cache)))
+
+    def _save_address_cache(self):
+        """ Stores versions looked up since the last save. Doesn't commit. """
+        if not self._unsaved_versions:
+            return
+        self.db.session.execute(
+            AddressVersion.__table__.insert().prefix_with('OR IGNORE'),
+            [dict(address=address, version=version)
+             for address, version in self._unsaved_versions.iteritems()])
+        self._unsaved_versions = {}
+
+    def _get_pull_cursor(self):
+        """ Returns the cursor SC gave us on the last pull, or None """
+        cursor = (self.db.session.query(PullState.cursor)
+                  .filter_by(currency_code=self.config['currency_code'])
+                  .scalar())
+        # Don't hold the database while we talk to SC
+        self.db.session.commit()
+        return cursor
+
+    def _set_pull_cursor(self, cursor):
+        """ Records a new pull cursor. Doesn't commit. """
+        if cursor is None:
+            return
+        self.db.session.merge(PullState(
+            currency_code=self.config['currency_code'],
+            cursor=str(cursor),
+            update_time=datetime.datetime.utcnow()))
 
     ########################################################################
     # RPC Client methods
@@ -206,26 +974,29 @@ class SCRPCClient(object):
         if simulate:
             self.logger.info('#'*20 + ' Simulation mode ' + '#'*20)
 
-        try:
-            payouts = self.post(
-                'get_payouts',
-                data={'currency': self.config['currency_code']}
-            )['pids']
-        except ConnectionError:
-            self.logger.warn('Unable to connect to SC!', exc_info=True)
-            return
+        data = {'currency': self.config['currency_code']}
+        since = None
+        if self.config['incremental_pull']:
+            since = self._get_pull_cursor()
+            if since is not None:
+                data['since'] = since
 
-        if not payouts:
-            self.logger.info("No {} payouts to process.."
-                             .format(self.config['currency_code']))
+        try:
+            res = self.post('get_payouts', data=data, stream=True, items='pids')
+        except SC_UNREACHABLE as e:
+            self.logger.warn('Unable to connect to SC: {}'.format(e))
             return
 
-        repeat = 0
+        # Payouts are parsed as they're iterated and inserted sql_chunk_size
+        # at a time, so memory doesn't grow with the size of the pull
         new = 0
+        repeat = 0
         invalid = 0
-        for user, address, amount, pid in payouts:
+        pull_time = datetime.datetime.utcnow()
+        rows = []
+        for user, address, amount, pid in res:
             # Check address is valid
-            if not get_bcaddress_version(address) in self.config['valid_address_versions']:
+            if not self.address_version(address) in self.config['valid_address_versions']:
                 self.logger.warn("Ignoring payout {} due to invalid address. "
                                  "{} address did not match a valid version {}"
                                  .format((user, address, amount, pid),
@@ -233,32 +1004,86 @@ class SCRPCClient(object):
                                          self.config['valid_address_versions']))
                 invalid += 1
                 continue
-            # Check payout doesn't already exist
-            if self.db.session.query(Payout).filter_by(pid=pid).first():
-                self.logger.debug("Ignoring payout {} because it already exists"
-                                  " locally".format((user, address, amount, pid)))
-                repeat += 1
-                continue
-            # Create local payout obj
-            p = Payout(pid=pid, user=user, address=address, amount=amount,
-                       currency_code=self.config['currency_code'],
-                       pull_time=datetime.datetime.utcnow())
-            new += 1
-
-            if not simulate:
-                self.db.session.add(p)
-
+            rows.append(dict(pid=pid, user=user, address=address, amount=amount,
+                             amount_int=to_base_units(amount),
+                             currency_code=self.config['currency_code'],
+                             pull_time=pull_time))
+            if len(rows) >= self.config['sql_chunk_size']:
+                inserted, skipped = self._insert_payouts(rows, simulate)
+                new += inserted
+                repeat += skipped
+                rows = []
+        if rows:
+            inserted, skipped = self._insert_payouts(rows, simulate)
+            new += inserted
+            repeat += skipped
+
+        # Servers that don't know about cursors just ignore 'since' and send
+        # the full list, which the pid deduplication handles fine
+        cursor = res.fields.get('cursor')
+        if cursor is None:
+            self.logger.debug("SC returned no pull cursor, performed a full "
+                              "{} payout pull".format(self.config['currency_code']))
+        elif since is not None:
+            self.logger.debug("Pulled {} payouts since cursor {}"
+                              .format(self.config['currency_code'], since))
+
+        # The cursor only advances once every chunk is in, so a failure part
+        # way through just means the next pull fetches those payouts again
+        if not simulate:
+            if self.config['incremental_pull']:
+                self._set_pull_cursor(cursor)
+            self._save_address_cache()
         self.db.session.commit()
 
+        if not new + repeat + invalid:
+            self.logger.info("No {} payouts to process.."
+                             .format(self.config['currency_code']))
+            return
+
         self.logger.info("Inserted {:,} new {} payouts and skipped {:,} old "
                          "payouts from the server. {:,} payouts with invalid addresses."
                          .format(new, self.config['currency_code'], repeat, invalid))
+        self.logger.info("Address version cache: {:,} hits, {:,} misses, "
+                         "{:,} entries"
+                         .format(self.address_cache.hits,
+                                 self.address_cache.misses,
+                                 len(self.address_cache)))
         return True
 
+    def _insert_payouts(self, rows, simulate=False):
+        """ Inserts a chunk of pulled payout rows in its own transaction,
+        skipping pids already stored or repeated in the chunk. Returns (new,
+        skipped) counts. """
+        unique = OrderedDict()
+        for row in rows:
+            unique.setdefault(row['pid'], row)
+        # Check which payouts already exist locally with a handful of IN
+        # queries instead of one query per payout
+        existing = self._existing_pids(unique)
+        for pid in existing:
+            row = unique.pop(pid)
+            self.logger.debug("Ignoring payout {} because it already exists"
+                              " locally".format((row['user'], row['address'],
+                                                 row['amount'], row['pid'])))
+
+        if simulate or not unique:
+            self.db.session.commit()
+            return len(unique), len(rows) - len(unique)
+
+        # OR IGNORE on the unique pid column keeps a single executemany safe
+        # even if a pid slipped in since we checked
+        with self._write_txn('insert payouts') as session:
+            inserted = session.execute(
+                Payout.__table__.insert().prefix_with('OR IGNORE'),
+                unique.values()).rowcount
+        return inserted, len(rows) - inserted
+
     @crontab
     def send_payout(self, simulate=False, payout_output_limit=10000):
         """ Collects all the unpaid payout ids (for the configured currency)
-        and pays them out """
+        and pays them out, in as many transactions of at most
+        payout_output_limit outputs (and max_tx_size bytes) as it takes """
         if simulate:
             self.logger.info('#'*20 + ' Simulation mode ' + '#'*20)
 
@@ -270,139 +1095,228 @@ class SCRPCClient(object):
                 "{}".format(self.config['currency_code'], e))
             return False
 
-        # Grab all payouts now so that we use the same list of payouts for both
-        # database transactions (locking, and unlocking)
-        payouts = (self.db.session.query(Payout).
-                   filter_by(txid=None,
-                             locked=False,
-                             currency_code=self.config['currency_code'])
-                   .all())
-
-        if not payouts:
-            self.logger.info("No payouts to process, exiting")
-            return True
-
-        # track the total payouts to each address
-        address_payout_amounts = {}
-        pids = {}
-        for payout in payouts:
-            address_payout_amounts.setdefault(payout.address, 0.0)
-            address_payout_amounts[payout.address] += float(payout.amount)
-            pids.setdefault(payout.address, [])
-            pids[payout.address].append(payout.pid)
-
-            # We'll lock the payout before continuing in case of a failure in
-            # between paying out and recording that payout action
-            payout.locked = True
-            payout.lock_time = datetime.datetime.utcnow()
-
-        for i, (address, amount) in enumerate(address_payout_amounts.items()):
-            # Convert amount from STR and coerce to a payable value.
-            # Note that we're not trying to validate the amount here, all
-            # validation should be handled server side.
-            amount = round(float(amount), 8)
-            if amount < self.config['minimum_tx_output'] or i > payout_output_limit:
-                # We're unable to pay, so undo the changes from the last loop
+        cc = self.config['currency_code']
+        unpaid = sa.and_(Payout.txid == None,
+                         Payout.locked == False,
+                         Payout.currency_code == cc)
+        minimum_output = to_base_units(self.config['minimum_tx_output'])
+
+        # Planning only reads, so it doesn't take the exclusive lock. The
+        # exclusive lock is only held by the short transactions that lock,
+        # finalize or unlock rows for each batch
+        with self.read_engine.begin() as conn:
+            # Pin the payouts this run works on, so payouts pulled while
+            # we're sending are left for the next run
+            max_id = conn.execute(sa.select([sa.func.max(Payout.id)])
+                                  .where(unpaid)).scalar()
+            if max_id is None:
+                self.logger.info("No payouts to process, exiting")
+                return True
+            unpaid = sa.and_(unpaid, Payout.id <= max_id)
+
+            # Total up each address in the database instead of loading every
+            # payout. Addresses are ordered so that each batch is a
+            # contiguous address range
+            totals = conn.execute(
+                sa.select([Payout.address,
+                           sa.func.sum(Payout.amount_int),
+                           sa.func.count(Payout.id)])
+                .where(unpaid)
+                .group_by(Payout.address)
+                .order_by(Payout.address)).fetchall()
+
+        # track the total payouts to each address, in base units. Note that
+        # we're not trying to validate the amount here, all validation should
+        # be handled server side.
+        address_payout_amounts = OrderedDict()
+        payout_counts = {}
+        for address, amount, count in totals:
+            if amount < minimum_output:
                 self.logger.warn('Removing {} with payout amount of {} (which '
                                  'is lower than network output min of {}) from '
                                  'the {} payout dictionary'
-                                 .format(address, amount,
-                                         self.config['minimum_tx_output'],
-                                         self.config['currency_code']))
-
-                address_payout_amounts.pop(address)
-                pids[address] = []
-                for payout in payouts:
-                    if payout.address == address:
-                        payout.locked = False
-                        payout.lock_time = None
-            else:
-                address_payout_amounts[address] = amount
+                                 .format(address, from_base_units(amount),
+                                         self.config['minimum_tx_output'], cc))
+                continue
+
+            address_payout_amounts[address] = amount
+            payout_counts[address] = count
 
-        total_out = sum(address_payout_amounts.values())
+        plan = self.planner.plan(address_payout_amounts, payout_output_limit)
+        fees = sum(tx.fee for tx in plan)
+        self.logger.info(
+            "Transaction plan at {}/kB\n".format(self.planner.fee_rate()) +
+            tabulate([(i, len(tx.addresses), from_base_units(tx.amount),
+                       tx.inputs, tx.size, tx.fee) for i, tx in enumerate(plan)],
+                     headers=["Tx", "Outputs", "Amount", "Est. inputs",
+                              "Est. size", "Est. fee"], tablefmt="grid"))
+
+        total_out = from_base_units(sum(address_payout_amounts.values()))
         balance = self.coin_rpc.get_balance(self.coin_rpc.coinserv['account'])
         self.logger.info("Account balance for {} account \'{}\': {:,}"
-                         .format(self.config['currency_code'],
-                                 self.coin_rpc.coinserv['account'], balance))
-        self.logger.info("Total to be paid {:,}".format(total_out))
+                         .format(cc, self.coin_rpc.coinserv['account'], balance))
+        self.logger.info("Total to be paid {:,} in {:,} transaction(s) with "
+                         "an estimated {:,} in fees"
+                         .format(total_out, len(plan), fees))
 
-        if balance < total_out:
+        if balance < total_out + fees:
             self.logger.error("Payout wallet is out of funds!")
-            self.db.session.rollback()
             # XXX: Add an email call here
             return False
 
         if total_out == 0:
             self.logger.info("Paying out 0 funds! Aborting...")
-            self.db.session.rollback()
             return True
 
-        if not simulate:
-            self.db.session.commit()
-        else:
-            self.db.session.rollback()
-
-        def format_pids(pids):
-            lst = ", ".join(pids[:9])
-            if len(pids) > 9:
-                return lst + "... ({} more)".format(len(pids) - 8)
-            return lst
-        summary = [(str(address), amount, str(format_pids(upids))) for
-                   (address, amount), upids in zip(address_payout_amounts.iteritems(), pids.itervalues())]
+        summary = [(i, str(address), from_base_units(address_payout_amounts[address]),
+                    payout_counts[address])
+                   for i, tx in enumerate(plan) for address in tx.addresses]
 
         self.logger.info(
-            "Address payment summary\n" + tabulate(summary, headers=["Address", "Total", "Pids"], tablefmt="grid"))
+            "Address payment summary\n" + tabulate(summary, headers=["Tx", "Address", "Total", "Payouts"], tablefmt="grid"))
+
+        if simulate:
+            res = raw_input("Would you like the simulation to associate fake "
+                            "txids with these payouts? Don't do this on "
+                            "production. [y/n] ")
+            if res != "y":
+                self.logger.info("Exiting")
+                return True
+
+        self.lock_stats = {}
+        results = []
+        for i, tx in enumerate(plan):
+            try:
+                result = self._send_batch(i, tx.addresses, address_payout_amounts,
+                                          unpaid, minimum_output, simulate=simulate)
+            except PayoutBatchFailed as e:
+                if e.locked:
+                    state = ("transaction {}'s payouts are still locked for "
+                             "review, the remaining payouts are unlocked"
+                             .format(i))
+                else:
+                    state = "the remaining payouts are still unlocked"
+                self.logger.error(
+                    "Stopped after {:,} of {:,} {} payout transactions. The "
+                    "sent transactions are recorded and {}."
+                    .format(i, len(plan), cc, state))
+                self._log_lock_stats()
+                return False
+            results.append(result)
+
+        self._log_lock_stats()
+        return results
+
+    def _send_batch(self, batch_no, addresses, amounts, unpaid, minimum_output,
+                    simulate=False):
+        """ Pays one batch of addresses (a contiguous range of the ordered
+        payable addresses) with a single sendmany, with its own lock and
+        finalize commits. Returns (txid, rpc_tx_obj, payout count), raises
+        PayoutBatchFailed if the transaction wasn't sent """
+        cc = self.config['currency_code']
+
+        # Before locking anything, so a daemon that's down leaves nothing
+        # locked
+        try:
+            balance = self.coin_rpc.get_balance(self.coin_rpc.coinserv['account'])
+        except CoinRPCException as e:
+            self.logger.error("Unable to get the {} wallet balance, not sending "
+                              "transaction {}: {}".format(cc, batch_no, e))
+            raise PayoutBatchFailed(locked=False)
+
+        # We'll lock the payouts before continuing in case of a failure in
+        # between paying out and recording that payout action. The lock time
+        # doubles as a token identifying the rows locked by this batch
+        lock_time = datetime.datetime.utcnow()
+        payable = (sa.select([Payout.address])
+                   .where(unpaid)
+                   .group_by(Payout.address)
+                   .having(sa.func.sum(Payout.amount_int) >= minimum_output)
+                   .correlate(None))
+        with self._write_txn('lock payouts') as session:
+            locked = session.execute(
+                Payout.__table__.update()
+                .where(sa.and_(unpaid,
+                               Payout.address.between(addresses[0], addresses[-1]),
+                               Payout.address.in_(payable)))
+                .values(locked=True, lock_time=lock_time))
+        this_batch = sa.and_(Payout.locked == True,
+                             Payout.lock_time == lock_time,
+                             Payout.txid == None,
+                             Payout.currency_code == cc)
+        self.logger.info("Locked {:,} {} payouts to {:,} addresses for "
+                         "transaction {}".format(locked.rowcount, cc,
+                                                 len(addresses), batch_no))
 
         try:
             if simulate:
-                coin_txid = "1111111111111111111111111111111111111111111111111111111111111111"
+                coin_txid = "{:1>64}".format(batch_no)
                 rpc_tx_obj = None
-                res = raw_input("Would you like the simulation to associate a "
-                                "fake txid {} with these payouts? Don't do "
-                                "this on production. [y/n] ".format(coin_txid))
-                if res != "y":
-                    self.logger.info("Exiting")
-                    return True
             else:
                 # finally run rpc call to payout
+                # Exact decimal amounts only at the RPC boundary
                 coin_txid, rpc_tx_obj = self.coin_rpc.send_many(
-                    self.coin_rpc.coinserv['account'], address_payout_amounts)
+                    self.coin_rpc.coinserv['account'],
+                    {address: from_base_units(amounts[address])
+                     for address in addresses})
         except CoinRPCException as e:
             self.logger.warn(e)
-            new_balance = self.coin_rpc.get_balance(self.coin_rpc.coinserv['account'])
+            if isinstance(e, CoinRPCCircuitOpen):
+                # Failed fast, the daemon was never asked
+                self.logger.error("Coinserver circuit is open, nothing was "
+                                  "sent. Unlocking payouts.")
+                self._unlock_batch(this_batch)
+                raise PayoutBatchFailed(locked=False)
+
+            try:
+                new_balance = self.coin_rpc.get_balance(
+                    self.coin_rpc.coinserv['account'])
+            except CoinRPCException:
+                new_balance = None
             if new_balance != balance:
                 self.logger.error(
-                    "RPC error occured and wallet balance changed! Keeping the "
+                    "RPC error occured and wallet balance {}! Keeping the "
                     "payout entries locked. simplecoin_rpc dump_incomplete can "
-                    "show you the details of the locked entries. If you're SURE"
+                    "show you the details of the locked entries. If you're SURE "
                     "a double payout hasn't occured, use simplecoin_rpc "
-                    "reset_all_locked to reset the entries.", exc_info=True)
-                return False
+                    "reset_all_locked to reset the entries."
+                    .format("couldn't be checked" if new_balance is None
+                            else "changed"), exc_info=True)
+                raise PayoutBatchFailed(locked=True)
             else:
                 self.logger.error("RPC error occured and wallet balance didn't "
                                   "change. Unlocking payouts.")
                 # Reset all the payouts so we can try again later
-                for payout in payouts:
-                    payout.locked = False
-
-                self.db.session.commit()
-                return False
+                self._unlock_batch(this_batch)
+                raise PayoutBatchFailed(locked=False)
         else:
             # Success! Now associate the txid and unlock to allow association
             # with remote to occur
-            payout_addrs = [address for address in address_payout_amounts.iterkeys()]
-            finalized_payouts = []
-            for payout in payouts:
-                if payout.address in payout_addrs:
-                    payout.locked = False
-                    payout.txid = coin_txid
-                    payout.paid_time = datetime.datetime.utcnow()
-                    finalized_payouts.append(payout)
-
-            self.db.session.commit()
-            self.logger.info("Updated {:,} (local) Payouts with txid {}"
-                             .format(len(finalized_payouts), coin_txid))
-            return coin_txid, rpc_tx_obj, finalized_payouts
+            paid_time = datetime.datetime.utcnow()
+            paid_start = time.time()
+            with self._write_txn('finalize payouts') as session:
+                finalized = session.execute(
+                    Payout.__table__.update()
+                    .where(this_batch)
+                    .values(locked=False, txid=coin_txid, paid_time=paid_time))
+                if rpc_tx_obj is not None:
+                    session.merge(Transaction(
+                        txid=coin_txid, currency_code=cc,
+                        fee=to_base_units(abs(rpc_tx_obj.fee)),
+                        output_count=len(addresses),
+                        total_amount=sum(amounts[a] for a in addresses),
+                        sent_time=paid_time))
+            self.logger.info("Updated {:,} (local) Payouts with txid {} in {:.3f}s"
+                             .format(finalized.rowcount, coin_txid,
+                                     time.time() - paid_start))
+            return coin_txid, rpc_tx_obj, finalized.rowcount
+
+    def _unlock_batch(self, this_batch):
+        with self._write_txn('unlock payouts') as session:
+            session.execute(
+                Payout.__table__.update()
+                .where(this_batch)
+                .values(locked=False, lock_time=None))
 
     @crontab
     def associate_all(self, simulate=False):
@@ -414,11 +1328,13 @@ class SCRPCClient(object):
         if simulate:
             self.logger.info('#'*20 + ' Simulation mode ' + '#'*20)
 
-        payouts = (self.db.session.query(Payout).
-                   filter_by(associated=False,
-                             currency_code=self.config['currency_code']).
-                   filter(Payout.txid != None)
-                   .all())
+        # Only the columns we need, and without taking the write lock
+        with self.read_engine.begin() as conn:
+            payouts = conn.execute(
+                sa.select([Payout.id, Payout.pid, Payout.txid])
+                .where(sa.and_(Payout.associated == False,
+                               Payout.currency_code == self.config['currency_code'],
+                               Payout.txid != None))).fetchall()
 
         # Build a dict keyed by txid to track payouts.
         txids = {}
@@ -426,18 +1342,14 @@ class SCRPCClient(object):
             txids.setdefault(payout.txid, [])
             txids[payout.txid].append(payout)
 
-        # Try to grab the fee for each txid
-        tx_fees = {}
-        for txid in txids.iterkeys():
-            try:
-                tx_fees[txid] = self.coin_rpc.get_transaction(txid).fee
-            except CoinRPCException as e:
+        tx_fees = self._transaction_fees(txids.keys(), simulate=simulate)
+
+        for txid, payouts in txids.iteritems():
+            if txid not in tx_fees:
                 self.logger.warn('Skipping transaction with id {}, failed '
                                  'looking it up from the {} wallet'
                                  .format(txid, self.config['currency_code']))
                 continue
-
-        for txid, payouts in txids.iteritems():
             if simulate:
                 self.logger.info("Attempting remote association of {:,} ids "
                                  "with txid {}".format(len(payouts), txid))
@@ -446,30 +1358,67 @@ class SCRPCClient(object):
     def associate(self, txid, payouts, tx_fee, simulate=False):
         """
         Attempt to associate Payout objects on SC with a specific transaction ID
-        that paid them. Also post the fee incurred by the transaction.
+        that paid them. Also post the fee incurred by the transaction. Payouts
+        may be anything with id and pid attributes, such as Payout rows.
         """
-        pids = [p.pid for p in payouts]
         self.logger.info("Trying to associate {:,} payouts with txid {}"
                          .format(len(payouts), txid))
 
-        data = {'coin_txid': txid, 'pids': pids, 'tx_fee': float(tx_fee),
-                'currency': self.config['currency_code']}
-
         if simulate:
             self.logger.info('We\'re simulating, so don\'t actually post to SC')
             return
 
-        res = self.post('associate_payouts', data=data)
-        if res['result']:
+        # Post the pids in chunks, a few at a time. Each chunk is marked
+        # associated as soon as it succeeds, so a failed or interrupted run
+        # only has to retry the chunks that didn't make it
+        payout_chunks = list(chunks(payouts, self.config['associate_chunk_size']))
+        # Read the pids here, the worker threads must not touch the session
+        pid_chunks = [(i, [p.pid for p in chunk])
+                      for i, chunk in enumerate(payout_chunks)]
+
+        # The worker threads don't see this thread's job deadline otherwise
+        deadline = getattr(self._local, 'deadline', None)
+
+        def post_chunk(args):
+            i, pids = args
+            data = {'coin_txid': txid, 'pids': pids, 'tx_fee': float(tx_fee),
+                    'currency': self.config['currency_code']}
+            try:
+                with self._deadline(deadline):
+                    return i, self.post('associate_payouts', data=data)['result']
+            except SC_UNREACHABLE + (SCRPCDeadlineExceeded, ) as e:
+                self.logger.warn("Unable to post association chunk {} of txid "
+                                 "{}: {}".format(i, txid, e))
+                return i, False
+            except Exception:
+                self.logger.error("Error posting association chunk {} of txid "
+                                  "{}".format(i, txid), exc_info=True)
+                return i, False
+
+        failed = 0
+        pool = ThreadPool(max(1, min(self.config['associate_threads'],
+                                     len(pid_chunks))))
+        try:
+            for i, result in pool.imap_unordered(post_chunk, pid_chunks):
+                if not result:
+                    failed += 1
+                    continue
+                with self._write_txn('mark payouts associated'):
+                    self._update_ids([p.id for p in payout_chunks[i]],
+                                     associated=True,
+                                     assoc_time=datetime.datetime.utcnow())
+        finally:
+            pool.close()
+            pool.join()
+
+        if not failed:
             self.logger.info("Received success response from the server.")
-            for payout in payouts:
-                payout.associated = True
-                payout.assoc_time = datetime.datetime.utcnow()
-            self.db.session.commit()
             return True
-        else:
-            self.logger.error("Failed to push association information for {} "
-                              "payouts!".format(self.config['currency_code']))
+
+        self.logger.error("Failed to push association information for {:,} of "
+                          "{:,} chunks of {} payouts!"
+                          .format(failed, len(pid_chunks),
+                                  self.config['currency_code']))
         return False
 
     @crontab
@@ -507,17 +1456,14 @@ class SCRPCClient(object):
         """
         payouts = (self.db.session.query(Payout)
                    .filter_by(txid=None, locked=True,
-                              currency_code=self.config['currency_code'])
-                   .all())
+                              currency_code=self.config['currency_code']))
         self.logger.info("Associating {:,} payout ids with TX ID {}"
-                         .format(len(payouts), tx_id))
+                         .format(payouts.count(), tx_id))
         if simulate:
             self.logger.info("Just kidding, we're simulating... Exit.")
             return
 
-        for payout in payouts:
-            payout.txid = tx_id
-
+        payouts.update({Payout.txid: tx_id}, synchronize_session=False)
         self.db.session.commit()
         return True
 
@@ -536,47 +1482,129 @@ class SCRPCClient(object):
                 "{}".format(self.config['currency_code'], e))
             return False
 
-        res = self.get('api/transaction?__filter_by={{"confirmed":false,"currency":"{}"}}'
-                       .format(self.config['currency_code']), signed=False)
+        # Pages come in one at a time and are posted back in bounded groups,
+        # so neither memory nor request size grows with the backlog
+        pages = self._unconfirmed_pages()
+        posted = 0
+        failed = 0
+        removed = None
+        while True:
+            try:
+                objects = pages.send(removed)
+            except StopIteration:
+                break
+            except SCRPCDeadlineExceeded as e:
+                self.logger.warn(str(e))
+                return False
+            except SC_UNREACHABLE as e:
+                self.logger.warn('Unable to connect to SC: {}'.format(e))
+                return False
+            except SCRPCException as e:
+                self.logger.error(str(e))
+                return False
+            confirmed, failures = self._confirm_page(
+                [sc_obj['txid'] for sc_obj in objects], simulate=simulate)
+            if confirmed is None:
+                return False
+            posted += confirmed
+            failed += failures
+            # Confirmed transactions drop out of SC's unconfirmed filter
+            removed = confirmed
 
-        if not res['success']:
-            self.logger.error("Failure grabbing unconfirmed transactions: {}".format(res))
+        if simulate:
             return
 
-        if not res['objects']:
+        if failed:
+            self.logger.error("Failed to push confirmation information for {:,} "
+                              "transactions".format(failed))
+            return False
+        if posted:
+            self.logger.info("Sucessfully confirmed {:,} transactions"
+                             .format(posted))
+            return True
+        if removed is None:
             self.logger.info("No transactions were returned to confirm...exiting.")
-            return
+
+    def _unconfirmed_pages(self):
+        """ Generator of pages of unconfirmed transactions from SC, at most
+        api_page_size each and api_max_pages in total. Send it the number of
+        transactions on the last page that got confirmed, they've dropped out
+        of the filter so the offset only moves past the rest. Offsets only
+        mean anything in a fixed order, so pages are ordered by txid. """
+        page_size = self.config['api_page_size']
+        offset = 0
+        for _ in xrange(self.config['api_max_pages']):
+            res = self.get('api/transaction?__filter_by={{"confirmed":false,"currency":"{}"}}'
+                           '&__order_by=txid&__limit={}&__offset={}'
+                           .format(self.config['currency_code'], page_size, offset),
+                           signed=False)
+            if not res['success']:
+                raise SCRPCException("Failure grabbing unconfirmed transactions: {}"
+                                     .format(res))
+            objects = res['objects']
+            if not objects:
+                return
+
+            removed = yield objects
+            # A short page is the last one. So is a long one, from a server
+            # that doesn't paginate
+            if len(objects) != page_size:
+                return
+            offset += len(objects) - (removed or 0)
+        else:
+            self.logger.warn("Stopped after {:,} pages of unconfirmed {} "
+                             "transactions".format(self.config['api_max_pages'],
+                                                   self.config['currency_code']))
+
+    def _confirm_page(self, txids, simulate=False):
+        """ Checks a page of txids for confirmations and posts the confirmed
+        ones to SC, confirm_post_size at a time. Returns (posted, failed)
+        counts, or (None, None) if confirmations couldn't be checked """
+        confirmations = self._confirmations(txids, simulate=simulate)
+        if confirmations is None:
+            return None, None
 
         tids = []
-        for sc_obj in res['objects']:
-            self.logger.debug("Connecting to coinserv to lookup confirms for {}"
-                              .format(sc_obj['txid']))
-            rpc_tx_obj = self.coin_rpc.get_transaction(sc_obj['txid'])
+        newly_confirmed = []
+        for txid in txids:
+            if confirmations.get(txid) is True:
+                tids.append(txid)
+                self.logger.info("Txid {} already confirmed locally".format(txid))
+                continue
+
+            if txid not in confirmations:
+                self.logger.warn("Skipping txid {}, failed looking it up from "
+                                 "the {} wallet"
+                                 .format(txid, self.config['currency_code']))
+                continue
 
-            if rpc_tx_obj.confirmations > self.config['min_confirms']:
-                tids.append(sc_obj['txid'])
+            if confirmations[txid] > self.config['min_confirms']:
+                tids.append(txid)
+                newly_confirmed.append(txid)
                 self.logger.info("Confirmed txid {} with {} confirms"
-                                 .format(sc_obj['txid'], rpc_tx_obj.confirmations))
+                                 .format(txid, confirmations[txid]))
             else:
                 self.logger.info("TX {} not yet confirmed. {}/{} confirms"
-                                 .format(sc_obj['txid'], rpc_tx_obj.confirmations,
+                                 .format(txid, confirmations[txid],
                                          self.config['min_confirms']))
 
         if simulate:
             self.logger.info('We\'re simulating, so don\'t actually post to SC')
-            return
+            return 0, 0
 
-        if tids:
-            data = {'tids': tids}
-            res = self.post('confirm_transactions', data=data)
-            if res['result']:
-                self.logger.info("Sucessfully confirmed transactions")
-                # XXX: Add number print outs
-                # XXX: Delete/archive payout row
-                return True
+        for txid in newly_confirmed:
+            self._record_transaction(txid, confirmed=True)
+        self.db.session.commit()
 
-            self.logger.error("Failed to push confirmation information")
-            return False
+        posted = 0
+        failed = 0
+        for group in chunks(tids, self.config['confirm_post_size']):
+            res = self.post('confirm_transactions', data={'tids': group})
+            if res['result']:
+                posted += len(group)
+            else:
+                failed += len(group)
+        return posted, failed
 
     @crontab
     def get_open_trade_requests(self):
@@ -587,8 +1615,8 @@ class SCRPCClient(object):
 
         try:
             trs = self.post('get_trade_requests')['trs']
-        except ConnectionError:
-            self.logger.warn('Unable to connect to SC!', exc_info=True)
+        except SC_UNREACHABLE as e:
+            self.logger.warn('Unable to connect to SC: {}'.format(e))
             return
 
         if not trs:
@@ -681,13 +1709,55 @@ class SCRPCClient(object):
         payouts.update({Payout.locked: False})
         self.db.session.commit()
 
+    @crontab
+    def reset_pull_cursor(self, simulate=False):
+        """ Forgets the pull cursor so the next pull_payouts is a full pull """
+        self.logger.info("Resetting {} pull cursor"
+                         .format(self.config['currency_code']))
+        if simulate:
+            self.logger.info("Just kidding, we're simulating... Exit.")
+            return
+
+        (self.db.session.query(PullState)
+         .filter_by(currency_code=self.config['currency_code'])
+         .delete())
+        self.db.session.commit()
+
     @crontab
     def init_db(self, simulate=False):
         """ Deletes all data from DB and rebuilds tables. Use carefully... """
-        Payout.__table__.drop(self.engine, checkfirst=True)
-        Payout.__table__.create(self.engine, checkfirst=True)
+        base.metadata.drop_all(self.engine, checkfirst=True)
+        base.metadata.create_all(self.engine, checkfirst=True)
         self.db.session.commit()
 
+    def dump_connection_stats(self):
+        """ Prints how often the shared HTTP session reused a connection """
+        print("@@ HTTP connections @@")
+        data = [(host, total, new, reused) for host, (total, new, reused)
+                in sorted(connection_stats().iteritems())]
+        print(tabulate(data, headers=["Host", "Requests", "New", "Reused"],
+                       tablefmt="grid"))
+
+    def dump_breakers(self):
+        """ Prints the state of the circuit breakers for SC and the
+        coinservers """
+        print("@@ Circuit breakers @@")
+        data = [(name, ) + state for name, state
+                in sorted(breaker_states().iteritems())]
+        print(tabulate(data, headers=["Remote", "State", "Failures",
+                                      "Times opened", "Calls rejected"],
+                       tablefmt="grid"))
+
+    def dump_signature_ages(self):
+        """ Prints how close response signatures came to their max_age """
+        print("@@ Signature ages @@")
+        data = [(endpoint, count, expired, total / count, ratio * 100)
+                for endpoint, (count, expired, total, ratio)
+                in sorted(self.signature_ages.iteritems())]
+        print(tabulate(data, headers=["Endpoint", "Responses", "Expired",
+                                      "Mean age (s)", "Max % of max_age"],
+                       tablefmt="grid", floatfmt=".1f"))
+
     def _tabulate(self, title, query, headers=None, data=None):
         """ Displays a table of payouts given a query to fetch payouts with, a
         title to label the table, and an optional list of columns to display
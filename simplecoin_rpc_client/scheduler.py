@@ -5,9 +5,12 @@ import setproctitle
 import argparse
 import yaml
 
+from multiprocessing.pool import ThreadPool
 from apscheduler.scheduler import Scheduler
 from cryptokit.rpc_wrapper import CoinRPC
+from simplecoin_rpc_client.blocknotify import BlockNotifyServer
 from simplecoin_rpc_client.sc_rpc import SCRPCClient
+from simplecoin_rpc_client.transport import breaker_states
 
 logger = logging.getLogger('apscheduler.scheduler')
 os_root = os.path.abspath(os.path.dirname(__file__) + '/../')
@@ -15,36 +18,58 @@ os_root = os.path.abspath(os.path.dirname(__file__) + '/../')
 
 class PayoutManager(object):
 
-    def __init__(self, logger, sc_rpc, coin_rpc):
+    def __init__(self, logger, sc_rpc, coin_rpc, concurrency=4):
         self.logger = logger
         self.sc_rpc = sc_rpc
         self.coin_rpc = coin_rpc
+        self.concurrency = concurrency
+
+    def _each_currency(self, func):
+        """ Runs func(sc_rpc) for every currency, up to concurrency at a
+        time. Each currency has its own database and coinserver, and they
+        share the thread safe HTTP session, so one currency's network waits
+        don't have to hold up the rest """
+        clients = self.sc_rpc.values()
+        if self.concurrency <= 1 or len(clients) <= 1:
+            for sc_rpc in clients:
+                func(sc_rpc)
+            return
+
+        def run(sc_rpc):
+            try:
+                func(sc_rpc)
+            except Exception:
+                self.logger.error("Unhandled exception in {} job"
+                                  .format(sc_rpc.config['currency_code']),
+                                  exc_info=True)
+
+        pool = ThreadPool(min(self.concurrency, len(clients)))
+        try:
+            pool.map(run, clients)
+        finally:
+            pool.close()
+            pool.join()
 
     def pull_payouts(self):
-        for currency, sc_rpc in self.sc_rpc.iteritems():
-            sc_rpc.pull_payouts()
+        self._each_currency(lambda sc_rpc: sc_rpc.pull_payouts())
 
     def send_payout(self):
-        for currency, sc_rpc in self.sc_rpc.iteritems():
-
+        def send(sc_rpc):
             # Try to pay out known payouts
             result = sc_rpc.send_payout()
             if isinstance(result, bool):
-                continue
-            else:
-                coin_txid, tx, payouts = result
-                sc_rpc.associate_all()
+                return
 
             # Push completed payouts to SC
-            sc_rpc.associate(coin_txid, payouts, tx.fee)
+            sc_rpc.associate_all()
+
+        self._each_currency(send)
 
     def associate_all_payouts(self):
-        for currency, sc_rpc in self.sc_rpc.iteritems():
-            sc_rpc.associate_all()
+        self._each_currency(lambda sc_rpc: sc_rpc.associate_all())
 
     def confirm_payouts(self):
-        for currency, sc_rpc in self.sc_rpc.iteritems():
-            sc_rpc.confirm_trans()
+        self._each_currency(lambda sc_rpc: sc_rpc.confirm_trans())
 
     def init_db(self):
         for currency, sc_rpc in self.sc_rpc.iteritems():
@@ -58,6 +83,16 @@ class PayoutManager(object):
         for currency, sc_rpc in self.sc_rpc.iteritems():
             sc_rpc.dump_complete()
 
+    def log_breakers(self):
+        """ Logs every circuit breaker that isn't closed """
+        for remote, (state, failures, trips, rejected) in \
+                sorted(breaker_states().iteritems()):
+            if state != 'closed':
+                self.logger.warn("Circuit to {} is {} ({} failures, opened {} "
+                                 "times, {} calls rejected)"
+                                 .format(remote, state, failures, trips,
+                                         rejected))
+
 
 def entry():
     parser = argparse.ArgumentParser(prog='simplecoin rpc client scheduler')
@@ -94,7 +129,8 @@ def entry():
         curr_cfg.update(cfg['sc_rpc_client'])
         sc_rpc[cc] = SCRPCClient(curr_cfg, coin_rpc[cc], logger=logger)
 
-    pm = PayoutManager(logger, sc_rpc, coin_rpc)
+    pm = PayoutManager(logger, sc_rpc, coin_rpc,
+                       concurrency=cfg.get('currency_concurrency', 4))
 
     sched = Scheduler(standalone=True)
     logger.info("=" * 80)
@@ -107,7 +143,15 @@ def entry():
     sched.add_cron_job(pm.send_payout, hour='23')
     sched.add_cron_job(pm.associate_all_payouts, hour='0')
     sched.add_cron_job(pm.confirm_payouts, hour='1')
-
+    sched.add_cron_job(pm.log_breakers, minute='*/1')
+
+    # Optionally confirm + associate as soon as the coin daemons see blocks
+    blocknotify = cfg.get('blocknotify') or {}
+    if blocknotify.get('enabled'):
+        BlockNotifyServer(sc_rpc,
+                          host=blocknotify.get('host', '127.0.0.1'),
+                          port=blocknotify.get('port', 9450),
+                          debounce=blocknotify.get('debounce', 10)).start()
 
     sched.start()
 
@@ -0,0 +1,316 @@
+import random
+import threading
+import time
+import zlib
+import requests
+
+from decimal import Decimal
+from requests.adapters import HTTPAdapter
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    # The C backend is many times faster, when it's built
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+if ijson is not None:
+    from ijson.common import ObjectBuilder
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=10):
+    """ Returns the requests.Session shared by every SCRPCClient in the
+    process, creating it on first use. Sharing it means calls to SC from any
+    currency reuse the same keep-alive connections instead of opening (and
+    TLS handshaking) a new one per call. urllib3's pools are thread safe, so
+    scheduler threads can share it. pool_size only applies on creation. """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            for prefix in ('http://', 'https://'):
+                session.mount(prefix, HTTPAdapter(pool_connections=pool_size,
+                                                  pool_maxsize=pool_size))
+            # requests transparently decodes either, streamed or not
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            _session = session
+        return _session
+
+
+def gzip_compress(data, level=6):
+    """ Returns data gzipped, for use with a Content-Encoding: gzip body """
+    if isinstance(data, unicode):
+        data = data.encode('utf8')
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class MsgpackPayload(object):
+    """ Payload serializer for itsdangerous that uses msgpack instead of
+    json. Signing and timestamps are unchanged, only the payload encoding
+    differs. Requires the optional msgpack package. """
+    content_type = 'application/x-msgpack'
+
+    @staticmethod
+    def dumps(obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    @staticmethod
+    def loads(data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class LimitedReader(object):
+    """ File-like view of the next size bytes of fileobj """
+
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class ItemStream(object):
+    """ The elements of the key array of a decoded object, with the object's
+    other top level fields in fields.
+
+    Given a file of JSON it's parsed incrementally with ijson as it's
+    iterated, so only one element is in memory at a time, and fields is only
+    complete once iteration finishes. Values are the same types json.loads
+    gives. Given an already decoded value it just wraps it. Either way close
+    is called once iteration ends. Iterate it once. """
+
+    def __init__(self, key, value=None, fileobj=None, close=None):
+        self.key = key
+        self.fileobj = fileobj
+        self._close = close
+        self.fields = {}
+        self._items = None
+        if value is not None:
+            self.fields = dict((k, v) for k, v in value.iteritems() if k != key)
+            self._items = value.get(key) or []
+
+    def __iter__(self):
+        try:
+            items = self._items if self._items is not None else self._parse()
+            for item in items:
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def _parse(self):
+        item_prefix = self.key + '.item'
+        item = field = None
+        for prefix, event, value in ijson.parse(self.fileobj):
+            if not prefix:
+                # Start, end and keys of the top level object
+                continue
+            if event == 'number' and isinstance(value, Decimal):
+                value = float(value)
+            done = event not in ('start_map', 'start_array', 'map_key')
+
+            name = prefix.split('.', 1)[0]
+            if name == self.key:
+                if prefix == self.key:
+                    # Start or end of the array itself
+                    continue
+                if item is None:
+                    item = ObjectBuilder()
+                item.event(event, value)
+                if prefix == item_prefix and done:
+                    yield item.value
+                    item = None
+            else:
+                if field is None:
+                    field = ObjectBuilder()
+                field.event(event, value)
+                if prefix == name and done:
+                    self.fields[name] = field.value
+                    field = None
+
+
+def connection_stats():
+    """ Returns a dict of host -> (requests, new connections, reused
+    connections) for the shared session's connection pools """
+    stats = {}
+    if _session is None:
+        return stats
+    for adapter in _session.adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            host = "{}:{}".format(pool.host, pool.port)
+            total, new, _ = stats.get(host, (0, 0, 0))
+            total += pool.num_requests
+            new += pool.num_connections
+            stats[host] = (total, new, total - new)
+    return stats
+
+
+class RetryPolicy(object):
+    """ Retries a call with exponential backoff and full jitter. A call gives
+    up after attempts tries, or when the next wait would take it past
+    deadline seconds since it started. Every retry also spends a token from a
+    budget that refills at budget tokens per budget_window seconds, so an
+    outage can't turn every call into a long series of retries. """
+
+    def __init__(self, attempts=4, backoff=0.5, max_backoff=30, deadline=300,
+                 budget=20, budget_window=60, logger=None):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.budget = budget
+        self.budget_window = budget_window
+        self.logger = logger
+        self._tokens = float(budget)
+        self._refilled = time.time()
+        self._lock = threading.Lock()
+
+    def _take_token(self):
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.budget, self._tokens + (now - self._refilled) *
+                               self.budget / float(self.budget_window))
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def delay(self, retry):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+    def call(self, func, retryable, name='call', deadline=None):
+        """ Calls func until it returns, retrying exceptions that retryable
+        returns True for. deadline, if given, is seconds from now and
+        tightens the policy's own deadline for this call """
+        if deadline is not None:
+            deadline = min(self.deadline, deadline)
+        else:
+            deadline = self.deadline
+        start = time.time()
+        retry = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if not retryable(e) or retry + 1 >= self.attempts:
+                    raise
+                delay = self.delay(retry)
+                if time.time() - start + delay > deadline:
+                    raise
+                if not self._take_token():
+                    if self.logger:
+                        self.logger.warn("Retry budget exhausted, not retrying "
+                                         "{}".format(name))
+                    raise
+                retry += 1
+                if self.logger:
+                    self.logger.warn("{} failed ({}), retry {} of {} in {:.1f}s"
+                                     .format(name, e, retry, self.attempts - 1,
+                                             delay))
+                time.sleep(delay)
+
+
+class CircuitBreaker(object):
+    """ Tracks the health of one remote. After threshold consecutive failures
+    the circuit opens and calls should fail fast without touching the
+    remote. Once cooldown seconds pass a single probe call is let through
+    (half-open): success closes the circuit, failure opens it for another
+    cooldown. Callers ask allow() before a call and report the outcome with
+    success() or failure(). """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, threshold=5, cooldown=60, logger=None):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.logger = logger
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and
+                    time.time() - self.opened >= self.cooldown):
+                self.state = self.HALF_OPEN
+                if self.logger:
+                    self.logger.info("Circuit to {} half-open, probing"
+                                     .format(self.name))
+                return True
+            # Open, or half-open with the probe still in flight
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != self.CLOSED and self.logger:
+                self.logger.info("Circuit to {} closed".format(self.name))
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                                self.failures >= self.threshold):
+                self.state = self.OPEN
+                self.opened = time.time()
+                self.trips += 1
+                if self.logger:
+                    self.logger.error("Circuit to {} opened after {} failures, "
+                                      "failing fast for {}s"
+                                      .format(self.name, self.failures,
+                                              self.cooldown))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, threshold=5, cooldown=60, logger=None):
+    """ Returns the process wide CircuitBreaker for a remote, creating it on
+    first use. Currencies sharing a remote share its breaker, so one dead
+    remote is only waited on until it trips. Settings only apply on
+    creation. """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, threshold, cooldown, logger)
+        return _breakers[name]
+
+
+def breaker_states():
+    """ Returns a dict of remote -> (state, consecutive failures, times
+    opened, calls rejected) for every breaker in the process """
+    with _breakers_lock:
+        return dict((name, (b.state, b.failures, b.trips, b.rejected))
+                    for name, b in _breakers.iteritems())
@@ -0,0 +1,481 @@
+""" Local stand-ins for SC and a coin daemon, shared by the tests and the
+benchmarks. Both listen on a free port on 127.0.0.1 and serve from a daemon
+thread, so a real SCRPCClient can be pointed at them. """
+import hashlib
+import itertools
+import json
+import logging
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import urlparse
+import zlib
+import requests
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from collections import namedtuple, OrderedDict
+from decimal import Decimal
+
+from cryptokit.rpc import CoinRPCException
+from itsdangerous import TimedSerializer, BadData
+
+from simplecoin_rpc_client.sc_rpc import SCRPCClient
+from simplecoin_rpc_client.transport import gzip_compress, MsgpackPayload
+
+
+SECRET = 'testing secret'
+CURRENCY = 'TST'
+# Testnet pay to pubkey hash
+ADDRESS_VERSION = 111
+
+logger = logging.getLogger('simplecoin_rpc_client.tests')
+logger.addHandler(logging.NullHandler())
+
+B58_CHARS = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def make_address(n, version=ADDRESS_VERSION):
+    """ A valid base58check address, the same for the same n """
+    raw = chr(version) + hashlib.sha256(str(n)).digest()[:20]
+    raw += hashlib.sha256(hashlib.sha256(raw).digest()).digest()[:4]
+    value = int(raw.encode('hex'), 16)
+    encoded = ''
+    while value:
+        value, mod = divmod(value, 58)
+        encoded = B58_CHARS[mod] + encoded
+    return B58_CHARS[0] * (len(raw) - len(raw.lstrip('\0'))) + encoded
+
+
+def make_payouts(count, addresses=None, start=0, amount=0.01):
+    """ count get_payouts style [user, address, amount, pid] lists, spread
+    over addresses distinct addresses (default one each) """
+    addresses = addresses or count
+    address_list = [make_address(i) for i in xrange(min(addresses, count + start))]
+    return [['user{}'.format(i % addresses), address_list[i % addresses],
+             amount, 'pid{}'.format(i)] for i in xrange(start, start + count)]
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        HTTPServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+
+    def process_request(self, request, client_address):
+        self.connections.add(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self.connections.discard(request)
+        HTTPServer.shutdown_request(self, request)
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up on a slow response are expected here
+        logger.debug("Error handling request from {}".format(client_address),
+                     exc_info=True)
+
+
+class FakeServer(object):
+    """ Serves handler_class on a free local port. Handlers reach the stand-in
+    through self.server.fake. Every response waits delay seconds first, to
+    stand in for a slow or distant server. """
+    handler_class = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.delay = 0
+        self.httpd = _HTTPServer(('127.0.0.1', 0), self.handler_class)
+        self.httpd.fake = self
+        self.port = self.httpd.server_address[1]
+        self.url = 'http://127.0.0.1:{}/'.format(self.port)
+
+    def start(self):
+        thread = threading.Thread(target=self.httpd.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        # Wake up handlers waiting on idle keep-alive connections
+        for connection in list(self.httpd.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so the client's pooled session behaves like against nginx
+    protocol_version = 'HTTP/1.1'
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _send(self, status, body, headers=None):
+        if self.server.fake.delay:
+            time.sleep(self.server.fake.delay)
+        self.send_response(status)
+        for key, value in (headers or {}).iteritems():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("{}: {}".format(self.server.fake.__class__.__name__,
+                                     format % args))
+
+
+class FakeSCHandler(_Handler):
+
+    def do_POST(self):
+        sc = self.server.fake
+        body = self._body()
+        name = self.path.split('/rpc/', 1)[-1]
+        serializer = sc.serializer_for(self.headers)
+
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                data = serializer.loads(
+                    zlib.decompress(body, 16 + zlib.MAX_WBITS))
+            else:
+                data = serializer.loads(body)
+        except BadData:
+            sc.record(name, self.headers, len(body), None)
+            return self._send(403, 'Invalid signature')
+        sc.record(name, self.headers, len(body), data)
+        if sc.take_failure(name):
+            return self._send(503, 'Service unavailable')
+        handler = getattr(sc, 'rpc_' + name, None)
+        if handler is None:
+            return self._send(404, 'Unknown endpoint {}'.format(name))
+        response = serializer.dumps(handler(data, self.headers))
+        headers = {'Content-Type': self.headers.get('Content-Type',
+                                                    'application/json')}
+        if (sc.compress_responses and
+                'gzip' in self.headers.get('Accept-Encoding', '')):
+            response = gzip_compress(response)
+            headers['Content-Encoding'] = 'gzip'
+        with sc.lock:
+            sc.response_sizes.append(len(response))
+        self._send(200, response, headers)
+
+    def do_GET(self):
+        sc = self.server.fake
+        path, _, query = self.path.partition('?')
+        if path.strip('/') != 'api/transaction':
+            return self._send(404, 'Unknown path {}'.format(path))
+        args = dict(urlparse.parse_qsl(query))
+        sc.record('api/transaction', self.headers, 0, args)
+        self._send(200, json.dumps(sc.api_transactions(args)),
+                   {'Content-Type': 'application/json'})
+
+
+Call = namedtuple('Call', ['name', 'headers', 'size', 'data'])
+
+
+class FakeSC(FakeServer):
+    """ Stand-in for SC's signed RPC endpoints. Set payouts to what
+    get_payouts should return. With supports_cursor get_payouts behaves like
+    a cursor aware SC, returning the payouts past 'since' and a new cursor,
+    otherwise it ignores 'since' like an older SC. Every call is recorded in
+    calls, the number of payouts sent by each get_payouts in served,
+    associated pids in associated and confirmed txids in confirmed.
+    Associated txids are listed by the unsigned api/transaction, in a random
+    order unless __order_by is given. The next fail_next[name] calls to an
+    endpoint get a 503 after being recorded. Gzipped request bodies are
+    accepted, and with compress_responses responses are gzipped for clients
+    that accept it. Calls record the size of the body as sent, response_sizes
+    the size of each signed response. Calls sent as msgpack are answered in
+    msgpack. """
+    handler_class = FakeSCHandler
+
+    def __init__(self, payouts=None, supports_cursor=False):
+        FakeServer.__init__(self)
+        self.serializer = TimedSerializer(SECRET)
+        self.payouts = payouts or []
+        self.supports_cursor = supports_cursor
+        self.served = []
+        self.calls = []
+        self.associated = {}
+        self.transactions = OrderedDict()
+        self.confirmed = set()
+        self.fail_next = {}
+        self.compress_responses = False
+        self.response_sizes = []
+
+    def record(self, name, headers, size, data):
+        with self.lock:
+            self.calls.append(Call(name, dict(headers), size, data))
+
+    def serializer_for(self, headers):
+        if headers.get('Content-Type') == MsgpackPayload.content_type:
+            return TimedSerializer(self.serializer.secret_key,
+                                   serializer=MsgpackPayload)
+        return self.serializer
+
+    def take_failure(self, name):
+        with self.lock:
+            if self.fail_next.get(name, 0) > 0:
+                self.fail_next[name] -= 1
+                return True
+        return False
+
+    def calls_to(self, name):
+        return [call for call in self.calls if call.name == name]
+
+    def rpc_get_payouts(self, data, headers):
+        if not self.supports_cursor:
+            self.served.append(len(self.payouts))
+            return {'pids': self.payouts}
+        # The cursor is just the number of payouts already sent
+        since = int(data.get('since', 0))
+        self.served.append(len(self.payouts) - since)
+        return {'pids': self.payouts[since:], 'cursor': len(self.payouts)}
+
+    def rpc_associate_payouts(self, data, headers):
+        with self.lock:
+            for pid in data['pids']:
+                self.associated.setdefault(pid, []).append(data['coin_txid'])
+            self.transactions[data['coin_txid']] = data['currency']
+        return {'result': True}
+
+    def rpc_confirm_transactions(self, data, headers):
+        with self.lock:
+            self.confirmed.update(data['tids'])
+        return {'result': True}
+
+    def api_transactions(self, args):
+        filters = json.loads(args.get('__filter_by', '{}'))
+        with self.lock:
+            objects = [{'txid': txid, 'currency': currency,
+                        'confirmed': txid in self.confirmed}
+                       for txid, currency in self.transactions.iteritems()]
+        objects = [obj for obj in objects
+                   if all(obj[key] == value for key, value in filters.items())]
+        # Like a database query without an ORDER BY
+        if '__order_by' in args:
+            objects.sort(key=lambda obj: obj[args['__order_by']])
+        else:
+            random.shuffle(objects)
+        offset = int(args.get('__offset', 0))
+        limit = int(args.get('__limit', len(objects)))
+        return {'success': True, 'objects': objects[offset:offset + limit]}
+
+
+class DaemonError(Exception):
+    """ A JSON-RPC error response from FakeCoinDaemon """
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.error = {'code': code, 'message': message}
+
+
+class FakeCoinDaemonHandler(_Handler):
+
+    def do_POST(self):
+        daemon = self.server.fake
+        request = json.loads(self._body(), parse_float=Decimal)
+        if isinstance(request, list):
+            response = [daemon.dispatch(call) for call in request]
+        else:
+            response = daemon.dispatch(request)
+        self._send(200, json.dumps(response, default=float),
+                   {'Content-Type': 'application/json'})
+
+
+class FakeCoinDaemon(FakeServer):
+    """ Stand-in for a bitcoind style JSON-RPC coin daemon with one wallet.
+    sendmany debits balance plus fee. The sendmany calls numbered (from 0)
+    in fail_sends fail as insufficient funds, without touching the balance
+    unless debit_failed_sends is set (a send that went out but errored).
+    Methods in fail_methods always error. mine() adds blocks, confirming
+    everything sent so far. """
+    handler_class = FakeCoinDaemonHandler
+
+    def __init__(self, balance=1000, fee=Decimal('0.0001')):
+        FakeServer.__init__(self)
+        self.balance = Decimal(balance)
+        self.fee = fee
+        self.fee_rate = Decimal('0.0001')
+        self.unspent = []
+        self.height = 100
+        self.transactions = {}
+        self.sends = []
+        self.fail_sends = set()
+        self.debit_failed_sends = False
+        self.fail_methods = set()
+        self.calls = []
+
+    def dispatch(self, call):
+        method = call['method']
+        with self.lock:
+            self.calls.append(method)
+        try:
+            if method in self.fail_methods:
+                raise DaemonError(-1, 'Daemon failure')
+            result = getattr(self, 'rpc_' + method)(*call.get('params', []))
+        except DaemonError as e:
+            return {'result': None, 'error': e.error, 'id': call.get('id')}
+        return {'result': result, 'error': None, 'id': call.get('id')}
+
+    def rpc_getinfo(self):
+        return {'blocks': self.height, 'balance': self.balance}
+
+    def rpc_getbalance(self, account=None):
+        return self.balance
+
+    def rpc_sendmany(self, account, recipients):
+        with self.lock:
+            send_no = len(self.sends)
+            self.sends.append(recipients)
+            total = sum(Decimal(str(v)) for v in recipients.itervalues())
+            if send_no in self.fail_sends or total + self.fee > self.balance:
+                if self.debit_failed_sends:
+                    self.balance -= total + self.fee
+                raise DaemonError(-6, 'Insufficient funds')
+            self.balance -= total + self.fee
+            # Unique across daemons, like real txids
+            txid = hashlib.sha256('tx{}:{}'.format(self.port,
+                                                   send_no)).hexdigest()
+            self.transactions[txid] = {'txid': txid, 'fee': -self.fee,
+                                       'amount': -total, 'height': None}
+            return txid
+
+    def rpc_gettransaction(self, txid):
+        tx = self.transactions.get(txid)
+        if tx is None:
+            raise DaemonError(-5, 'Invalid or non-wallet transaction id')
+        result = dict(tx, confirmations=0)
+        height = result.pop('height')
+        if height is not None:
+            result['confirmations'] = self.height - height + 1
+            result['blockhash'] = self.block_hash(height)
+        return result
+
+    def rpc_getblockcount(self):
+        return self.height
+
+    def rpc_getblockhash(self, height):
+        return self.block_hash(height)
+
+    def rpc_estimatefee(self, blocks):
+        return self.fee_rate
+
+    def rpc_listunspent(self):
+        return self.unspent
+
+    @staticmethod
+    def block_hash(height):
+        return '{:064x}'.format(height)
+
+    def mine(self, blocks=1):
+        with self.lock:
+            for tx in self.transactions.itervalues():
+                if tx['height'] is None:
+                    tx['height'] = self.height + 1
+            self.height += blocks
+
+
+class _RPCProxy(object):
+    _ids = itertools.count()
+
+    def __init__(self, url):
+        self.url = url
+
+    def __getattr__(self, method):
+        def call(*params):
+            ret = requests.post(self.url, data=json.dumps(
+                {'version': '1.1', 'method': method, 'params': params,
+                 'id': next(self._ids)}, default=str), timeout=10)
+            response = ret.json(parse_float=Decimal)
+            if response.get('error'):
+                raise CoinRPCException(response['error'])
+            return response['result']
+        return call
+
+
+SentTx = namedtuple('SentTx', ['txid', 'fee'])
+
+
+class FakeCoinRPC(object):
+    """ Stand-in for cryptokit's CoinRPC wrapper, talking to a
+    FakeCoinDaemon """
+
+    def __init__(self, daemon, account=''):
+        self.coinserv = {'address': '127.0.0.1', 'port': daemon.port,
+                         'username': 'user', 'password': 'pass',
+                         'account': account}
+        self.conn = _RPCProxy(daemon.url)
+
+    def poke_rpc(self):
+        self.conn.getinfo()
+
+    def get_balance(self, account=None):
+        return self.conn.getbalance(account)
+
+    def send_many(self, account, recipients):
+        txid = self.conn.sendmany(account, recipients)
+        return txid, SentTx(txid, -self.conn.gettransaction(txid)['fee'])
+
+
+def make_client(sc, daemon, **config):
+    """ An SCRPCClient for CURRENCY using the stand-ins, with its database in
+    a new temporary directory. Call close_client when done. """
+    tmpdir = tempfile.mkdtemp(prefix='sc_rpc_test')
+    conf = dict(currency_code=CURRENCY,
+                rpc_signature=SECRET,
+                rpc_url=sc.url,
+                valid_address_versions=[ADDRESS_VERSION],
+                database_path=tmpdir + '/rpc_',
+                log_path=None,
+                retry_backoff=0.01)
+    conf.update(config)
+    client = SCRPCClient(conf, FakeCoinRPC(daemon), logger=logger)
+    client.tmpdir = tmpdir
+    return client
+
+
+def close_client(client):
+    client.db.session.close()
+    client.engine.dispose()
+    shutil.rmtree(client.tmpdir, ignore_errors=True)
+
+
+class LogMessages(logging.Handler):
+    """ Collects the records and messages logged through it """
+
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.records = []
+        self.messages = []
+
+    def emit(self, record):
+        self.records.append(record)
+        self.messages.append(record.getMessage())
+
+
+class StandInTestCase(unittest.TestCase):
+    """ Starts a FakeSC and FakeCoinDaemon and a client using them for each
+    test. Override client_config to change the client's config. """
+    client_config = {}
+
+    def setUp(self):
+        self.sc = FakeSC().start()
+        self.daemon = FakeCoinDaemon().start()
+        self.client = make_client(self.sc, self.daemon, **self.client_config)
+
+    def tearDown(self):
+        close_client(self.client)
+        self.sc.stop()
+        self.daemon.stop()
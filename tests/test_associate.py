@@ -0,0 +1,58 @@
+from simplecoin_rpc_client.sc_rpc import Payout, Transaction
+from tests.fakes import StandInTestCase, make_payouts
+
+
+class TestAssociateAll(StandInTestCase):
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        self.sc.payouts = make_payouts(6, addresses=3, amount=1)
+        self.client.pull_payouts()
+        self.client.send_payout()
+
+    def forget_transactions(self):
+        # As if sent before the transactions table existed
+        self.client.db.session.query(Transaction).delete()
+        self.client.db.session.commit()
+
+    def count(self, model, **filters):
+        count = self.client.db.session.query(model).filter_by(**filters).count()
+        self.client.db.session.commit()
+        return count
+
+    def stored_fees(self):
+        fees = [fee for (fee, ) in self.client.db.session.query(Transaction.fee)]
+        self.client.db.session.commit()
+        return fees
+
+    def assertPositiveFees(self):
+        self.assertEqual(self.stored_fees(), [10000])
+        call, = self.sc.calls_to('associate_payouts')
+        self.assertEqual(len(call.data['pids']), 6)
+        self.assertEqual(call.data['tx_fee'], 0.0001)
+
+    def test_fee_recorded_at_send(self):
+        self.client.associate_all()
+        self.assertEqual(self.count(Payout, associated=True), 6)
+        self.assertPositiveFees()
+
+    def test_looks_up_and_records_fees(self):
+        self.forget_transactions()
+        self.client.associate_all()
+        self.assertEqual(self.count(Payout, associated=True), 6)
+        self.assertPositiveFees()
+
+    def test_negative_recorded_fee(self):
+        # Looked up fees used to be recorded with bitcoind's sign
+        self.client.db.session.query(Transaction).update({'fee': -10000})
+        self.client.db.session.commit()
+        self.client.associate_all()
+        call, = self.sc.calls_to('associate_payouts')
+        self.assertEqual(call.data['tx_fee'], 0.0001)
+
+    def test_simulate_writes_nothing(self):
+        self.forget_transactions()
+        self.client.associate_all(simulate=True)
+        self.assertEqual(self.count(Transaction), 0)
+        self.assertEqual(self.count(Payout, associated=True), 0)
+        self.assertEqual(self.sc.calls_to('associate_payouts'), [])
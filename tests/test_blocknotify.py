@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+
+from simplecoin_rpc_client.blocknotify import BlockNotifyServer, notify
+from tests.fakes import (StandInTestCase, LogMessages, CURRENCY, make_payouts,
+                         logger)
+
+
+class TestBlockNotifyBurst(StandInTestCase):
+    client_config = {'min_confirms': 1}
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        self.sc.payouts = make_payouts(40, addresses=20, amount=1)
+        self.client.pull_payouts()
+        # Several transactions to associate and confirm
+        self.client.send_payout(payout_output_limit=4)
+        self.daemon.mine(3)
+
+        self.errors = LogMessages(logging.ERROR)
+        logger.addHandler(self.errors)
+        logging.getLogger('apscheduler.scheduler').addHandler(self.errors)
+        self.server = BlockNotifyServer({CURRENCY: self.client}, port=0,
+                                        debounce=0.001)
+        self.server.start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        logger.removeHandler(self.errors)
+        logging.getLogger('apscheduler.scheduler').removeHandler(self.errors)
+        StandInTestCase.tearDown(self)
+
+    def wait_for_job(self, job, timeout=10):
+        end = time.time() + timeout
+        while time.time() < end:
+            with job._lock:
+                if not (job._pending or job._running):
+                    return
+            time.sleep(0.01)
+        self.fail("Block job still running")
+
+    def test_burst_during_pulls(self):
+        def burst():
+            for _ in xrange(40):
+                notify(self.url, CURRENCY)
+                time.sleep(0.002)
+        notifier = threading.Thread(target=burst)
+        notifier.start()
+        # The scheduler's jobs keep running meanwhile
+        start = 40
+        while notifier.is_alive():
+            self.sc.payouts += make_payouts(5, start=start)
+            start += 5
+            self.client.pull_payouts()
+            self.client.associate_all()
+        notifier.join()
+        self.wait_for_job(self.server.jobs[CURRENCY])
+
+        self.assertEqual(self.errors.messages, [])
+        self.assertEqual(len(self.sc.associated), 40)
+        self.assertTrue(all(len(txids) == 1
+                            for txids in self.sc.associated.itervalues()))
+        self.assertEqual(self.sc.confirmed, set(self.sc.transactions))
@@ -0,0 +1,35 @@
+from simplecoin_rpc_client.sc_rpc import Payout
+from tests.fakes import StandInTestCase, make_payouts
+
+
+class TestCompression(StandInTestCase):
+    client_config = {'compress_requests': True, 'compress_min_size': 1024}
+
+    def associate(self, count):
+        pids = ['pid{}'.format(i) for i in xrange(count)]
+        self.client.post('associate_payouts',
+                         data={'coin_txid': 'a' * 64, 'pids': pids,
+                               'tx_fee': 0.0001, 'currency': 'TST'})
+        return self.sc.calls_to('associate_payouts')[-1]
+
+    def test_large_requests_gzipped(self):
+        call = self.associate(2000)
+        self.assertEqual(call.headers.get('content-encoding'), 'gzip')
+        # Verified and decoded after decompressing
+        self.assertEqual(len(call.data['pids']), 2000)
+        self.assertEqual(len(self.sc.associated), 2000)
+        self.assertLess(call.size, len(self.sc.serializer.dumps(call.data)) / 3)
+
+    def test_small_requests_not_gzipped(self):
+        call = self.associate(3)
+        self.assertNotIn('content-encoding', call.headers)
+        self.assertEqual(len(self.sc.associated), 3)
+
+    def test_gzipped_streamed_response(self):
+        self.sc.payouts = make_payouts(2000, addresses=100)
+        self.sc.compress_responses = True
+        self.client.pull_payouts()
+        self.assertEqual(self.client.db.session.query(Payout).count(), 2000)
+        self.client.db.session.commit()
+        self.assertLess(self.sc.response_sizes[-1],
+                        len(self.sc.serializer.dumps({'pids': self.sc.payouts})) / 3)
@@ -0,0 +1,24 @@
+from tests.fakes import StandInTestCase, make_payouts
+
+
+class TestConfirmTrans(StandInTestCase):
+    client_config = {'min_confirms': 1, 'api_page_size': 3}
+
+    def send(self, start):
+        # Five transactions of two outputs each
+        self.sc.payouts = make_payouts(10, start=start, amount=1)
+        self.client.pull_payouts()
+        results = self.client.send_payout(payout_output_limit=2)
+        self.client.associate_all()
+        return set(txid for txid, _, _ in results)
+
+    def test_pages_past_unconfirmed_transactions(self):
+        confirmed = self.send(0)
+        self.daemon.mine(3)
+        # Still unconfirmed, so they stay in SC's filter between pages
+        self.send(10)
+
+        self.client.confirm_trans()
+        self.assertEqual(self.sc.confirmed, confirmed)
+        pages = self.sc.calls_to('api/transaction')
+        self.assertTrue(all(call.data['__order_by'] == 'txid' for call in pages))
@@ -0,0 +1,47 @@
+from collections import OrderedDict
+from decimal import Decimal
+
+from tests.fakes import StandInTestCase, make_address
+
+
+class TestPayoutPlanner(StandInTestCase):
+
+    def amounts(self, count, amount=100000000):
+        return OrderedDict((make_address(i), amount) for i in xrange(count))
+
+    def test_uses_daemon_estimate(self):
+        self.daemon.fee_rate = Decimal('0.0005')
+        self.assertEqual(self.client.planner.fee_rate(), Decimal('0.0005'))
+        self.assertIn('estimatefee', self.daemon.calls)
+
+    def test_estimate_never_below_tx_fee(self):
+        self.client.config['tx_fee'] = 0.001
+        self.daemon.fee_rate = Decimal('0.0005')
+        self.assertEqual(self.client.planner.fee_rate(), Decimal('0.001'))
+
+    def test_falls_back_without_estimate(self):
+        self.daemon.fee_rate = -1
+        self.assertEqual(self.client.planner.fee_rate(), Decimal('0.0001'))
+
+    def test_falls_back_on_daemon_error(self):
+        self.daemon.fail_methods.update(['estimatefee', 'listunspent'])
+        self.assertEqual(self.client.planner.fee_rate(), Decimal('0.0001'))
+        self.assertIsNone(self.client.planner.utxo_value())
+
+    def test_splits_on_output_limit(self):
+        plan = self.client.planner.plan(self.amounts(10), 4)
+        self.assertEqual([len(tx.addresses) for tx in plan], [4, 4, 2])
+        self.assertEqual([a for tx in plan for a in tx.addresses],
+                         list(self.amounts(10)))
+
+    def test_splits_on_size(self):
+        # Room for three outputs with one input
+        self.client.config['max_tx_size'] = 300
+        plan = self.client.planner.plan(self.amounts(7), 100)
+        self.assertEqual([len(tx.addresses) for tx in plan], [3, 3, 1])
+        self.assertTrue(all(tx.size <= 300 for tx in plan))
+
+    def test_inputs_from_unspent_outputs(self):
+        self.daemon.unspent = [{'amount': Decimal('0.5')}] * 4
+        plan = self.client.planner.plan(self.amounts(3), 100)
+        self.assertEqual(plan[0].inputs, 6)
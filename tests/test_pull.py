@@ -0,0 +1,105 @@
+from simplecoin_rpc_client.sc_rpc import Payout, AddressVersion
+from tests.fakes import StandInTestCase, make_payouts, make_address
+
+
+class TestPullPayouts(StandInTestCase):
+
+    def stored_pids(self):
+        pids = set(pid for (pid, ) in self.client.db.session.query(Payout.pid))
+        self.client.db.session.commit()
+        return pids
+
+    def test_inserts_new_payouts(self):
+        self.sc.payouts = make_payouts(1200, addresses=50)
+        self.assertTrue(self.client.pull_payouts())
+        self.assertEqual(self.stored_pids(),
+                         set(p[3] for p in self.sc.payouts))
+
+        payout = (self.client.db.session.query(Payout)
+                  .filter_by(pid='pid7').one())
+        self.assertEqual(payout.address, make_address(7))
+        self.assertEqual(payout.amount_int, 1000000)
+
+    def test_skips_existing_duplicate_and_invalid(self):
+        self.sc.payouts = make_payouts(10)
+        self.client.pull_payouts()
+
+        self.sc.payouts = (make_payouts(15) + make_payouts(2, start=12) +
+                           [['user', make_address(1, version=0), 0.01, 'bad']])
+        self.client.pull_payouts()
+        self.assertEqual(self.stored_pids(),
+                         set('pid{}'.format(i) for i in xrange(15)))
+
+    def test_simulate_stores_nothing(self):
+        self.sc.payouts = make_payouts(10)
+        self.client.pull_payouts(simulate=True)
+        self.assertEqual(self.stored_pids(), set())
+
+
+class TestIncrementalPull(StandInTestCase):
+
+    def pull(self):
+        self.client.pull_payouts()
+        return self.sc.calls_to('get_payouts')[-1].data
+
+    def stored(self):
+        count = self.client.db.session.query(Payout).count()
+        self.client.db.session.commit()
+        return count
+
+    def test_cursor_server_only_sends_new_payouts(self):
+        self.sc.supports_cursor = True
+        self.sc.payouts = make_payouts(100)
+        self.assertNotIn('since', self.pull())
+
+        self.sc.payouts += make_payouts(5, start=100)
+        self.assertEqual(self.pull()['since'], '100')
+        self.assertEqual(self.sc.served, [100, 5])
+        self.assertEqual(self.stored(), 105)
+
+        # Nothing new still advances cleanly
+        self.assertEqual(self.pull()['since'], '105')
+        self.assertEqual(self.sc.served[-1], 0)
+
+    def test_old_server_gets_full_pulls(self):
+        self.sc.payouts = make_payouts(100)
+        self.pull()
+        self.sc.payouts += make_payouts(5, start=100)
+        self.assertNotIn('since', self.pull())
+        self.assertEqual(self.sc.served, [100, 105])
+        self.assertEqual(self.stored(), 105)
+
+    def test_reset_cursor_forces_full_pull(self):
+        self.sc.supports_cursor = True
+        self.sc.payouts = make_payouts(10)
+        self.pull()
+        self.client.reset_pull_cursor()
+        self.assertNotIn('since', self.pull())
+        self.assertEqual(self.stored(), 10)
+
+    def test_disabled_never_sends_cursor(self):
+        self.client.config['incremental_pull'] = False
+        self.sc.supports_cursor = True
+        self.sc.payouts = make_payouts(10)
+        self.pull()
+        self.assertNotIn('since', self.pull())
+        self.assertEqual(self.sc.served, [10, 10])
+
+
+class TestAddressCache(StandInTestCase):
+    client_config = {'persist_address_cache': True}
+
+    def saved_versions(self):
+        count = self.client.db.session.query(AddressVersion).count()
+        self.client.db.session.commit()
+        return count
+
+    def test_persists_versions(self):
+        self.sc.payouts = make_payouts(20, addresses=5)
+        self.client.pull_payouts()
+        self.assertEqual(self.saved_versions(), 5)
+
+    def test_simulate_persists_nothing(self):
+        self.sc.payouts = make_payouts(20, addresses=5)
+        self.client.pull_payouts(simulate=True)
+        self.assertEqual(self.saved_versions(), 0)
@@ -0,0 +1,50 @@
+from simplecoin_rpc_client.sc_rpc import Payout
+from tests.fakes import StandInTestCase, make_payouts
+
+
+class TestRetries(StandInTestCase):
+    client_config = {'retry_attempts': 4, 'retry_budget': 3,
+                     'breaker_threshold': 100}
+
+    def test_retries_reuse_idempotency_key(self):
+        self.sc.payouts = make_payouts(4, amount=1)
+        self.client.pull_payouts()
+        # Two transactions, so two logical associate_payouts posts
+        self.client.send_payout(payout_output_limit=2)
+        self.sc.fail_next['associate_payouts'] = 2
+        self.client.associate_all()
+
+        calls = self.sc.calls_to('associate_payouts')
+        self.assertEqual(len(calls), 4)
+        keys = [call.headers['idempotency-key'] for call in calls]
+        first = [k for k, call in zip(keys, calls)
+                 if call.data['coin_txid'] == calls[0].data['coin_txid']]
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(set(first)), 1)
+        self.assertEqual(len(set(keys)), 2)
+        self.assertEqual(len(self.sc.associated), 4)
+
+    def test_budget_stops_retries(self):
+        self.sc.fail_next['get_payouts'] = 100
+        self.client.pull_payouts()
+        self.client.pull_payouts()
+        # Three retries in the budget, then every call is tried once
+        self.assertEqual(len(self.sc.calls_to('get_payouts')), 4 + 1)
+        self.client.pull_payouts()
+        self.assertEqual(len(self.sc.calls_to('get_payouts')), 4 + 1 + 1)
+
+
+class TestRetryAttempts(StandInTestCase):
+    client_config = {'retry_attempts': 3, 'retry_budget': 100,
+                     'breaker_threshold': 100}
+
+    def test_gives_up_after_attempts(self):
+        self.sc.payouts = make_payouts(5)
+        self.sc.fail_next['get_payouts'] = 2
+        self.client.pull_payouts()
+        self.assertEqual(self.client.db.session.query(Payout).count(), 5)
+        self.client.db.session.commit()
+
+        self.sc.fail_next['get_payouts'] = 10
+        self.client.pull_payouts()
+        self.assertEqual(len(self.sc.calls_to('get_payouts')), 3 + 3)
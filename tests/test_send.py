@@ -0,0 +1,124 @@
+from simplecoin_rpc_client.batch_rpc import CoinRPCCircuitOpen
+from simplecoin_rpc_client.sc_rpc import Payout, Transaction
+from tests.fakes import StandInTestCase, LogMessages, make_payouts, logger
+
+
+class SendTestCase(StandInTestCase):
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        self.sc.payouts = make_payouts(12, addresses=6, amount=1)
+        self.client.pull_payouts()
+        self.log = LogMessages()
+        logger.addHandler(self.log)
+
+    def tearDown(self):
+        logger.removeHandler(self.log)
+        StandInTestCase.tearDown(self)
+
+    def assertLogged(self, *parts):
+        for message in self.log.messages:
+            if all(part in message for part in parts):
+                return
+        self.fail("Nothing logged with {}".format(parts))
+
+    def fail_balance_after(self, calls):
+        """ get_balance works for the first calls calls, then the circuit
+        opens """
+        original = self.client.coin_rpc.get_balance
+        made = []
+
+        def get_balance(account):
+            made.append(account)
+            if len(made) > calls:
+                raise CoinRPCCircuitOpen({'code': -1, 'message': 'open'})
+            return original(account)
+        self.client.coin_rpc.get_balance = get_balance
+
+    def payouts(self, **filters):
+        count = self.client.db.session.query(Payout).filter_by(**filters).count()
+        self.client.db.session.commit()
+        return count
+
+    def send(self):
+        # Two outputs per transaction, so three batches
+        return self.client.send_payout(payout_output_limit=2)
+
+
+class TestSendPayout(SendTestCase):
+
+    def test_sends_each_batch(self):
+        results = self.send()
+        self.assertEqual([count for _, _, count in results], [4, 4, 4])
+        self.assertEqual([len(send) for send in self.daemon.sends], [2, 2, 2])
+        self.assertEqual(self.payouts(txid=None), 0)
+        self.assertEqual(self.payouts(locked=True), 0)
+        self.assertEqual(
+            sorted(tx.txid for tx in self.client.db.session.query(Transaction)),
+            sorted(txid for txid, _, _ in results))
+
+    def test_failure_keeps_earlier_batches(self):
+        self.daemon.fail_sends = {1}
+        self.assertFalse(self.send())
+        txid = self.daemon.transactions.keys()[0]
+        self.assertEqual(self.payouts(txid=txid, locked=False), 4)
+        self.assertEqual(self.payouts(txid=None, locked=False), 8)
+
+        # The rest go out on the next run
+        self.daemon.fail_sends = set()
+        self.assertEqual([count for _, _, count in self.send()], [4, 4])
+        self.assertEqual(self.payouts(txid=None), 0)
+
+    def test_out_of_funds_sends_nothing(self):
+        # 12 to pay, short of it once fees are added
+        self.daemon.balance = 12
+        self.assertFalse(self.send())
+        self.assertEqual(self.daemon.sends, [])
+        self.assertEqual(self.payouts(txid=None, locked=False), 12)
+
+
+class TestSendFailures(SendTestCase):
+
+    def test_balance_unavailable_locks_nothing(self):
+        # send_payout's own balance check works, the batch's doesn't
+        self.fail_balance_after(1)
+        self.assertFalse(self.send())
+        self.assertEqual(self.daemon.sends, [])
+        self.assertEqual(self.payouts(locked=True), 0)
+        self.assertLogged('Stopped after 0 of 3',
+                          'remaining payouts are still unlocked')
+
+    def test_open_circuit_unlocks_batch(self):
+        def send_many(*args):
+            raise CoinRPCCircuitOpen({'code': -1, 'message': 'open'})
+        self.client.coin_rpc.send_many = send_many
+        self.assertFalse(self.send())
+        self.assertEqual(self.payouts(locked=True), 0)
+        self.assertLogged('Stopped after 0 of 3',
+                          'remaining payouts are still unlocked')
+
+    def test_unchanged_balance_unlocks_batch(self):
+        self.daemon.fail_sends = {1}
+        self.assertFalse(self.send())
+        self.assertEqual(self.payouts(locked=True), 0)
+        self.assertEqual(self.payouts(txid=None), 8)
+        self.assertLogged('Stopped after 1 of 3',
+                          'remaining payouts are still unlocked')
+
+    def test_changed_balance_keeps_batch_locked(self):
+        self.daemon.fail_sends = {1}
+        self.daemon.debit_failed_sends = True
+        self.assertFalse(self.send())
+        self.assertEqual(self.payouts(locked=True), 4)
+        self.assertEqual(self.payouts(txid=None, locked=False), 4)
+        self.assertLogged('Stopped after 1 of 3',
+                          "transaction 1's payouts are still locked")
+
+    def test_unreadable_balance_keeps_batch_locked(self):
+        # Readable before the failed send, not after it
+        self.daemon.fail_sends = {0}
+        self.fail_balance_after(2)
+        self.assertFalse(self.send())
+        self.assertEqual(self.payouts(locked=True), 4)
+        self.assertLogged('Stopped after 0 of 3',
+                          "transaction 0's payouts are still locked")
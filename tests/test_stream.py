@@ -0,0 +1,99 @@
+import unittest
+
+from StringIO import StringIO
+
+from itsdangerous import TimedSerializer
+
+from simplecoin_rpc_client import sc_rpc
+from simplecoin_rpc_client.sc_rpc import Payout, SCRPCException
+from simplecoin_rpc_client.transport import ItemStream, ijson
+from tests.fakes import (StandInTestCase, LogMessages, make_client,
+                         close_client, make_payouts, logger)
+
+
+@unittest.skipIf(ijson is None, "ijson isn't installed")
+class TestItemStream(unittest.TestCase):
+
+    def parse(self, text, key='pids'):
+        stream = ItemStream(key, fileobj=StringIO(text))
+        return list(stream), stream.fields
+
+    def test_fields_after_items(self):
+        items, fields = self.parse(
+            '{"pids": [["u", "a", 0.5, "p1"], ["u", "b", 1, "p2"]], '
+            '"cursor": 12}')
+        self.assertEqual(items, [[u"u", u"a", 0.5, u"p1"], [u"u", u"b", 1, u"p2"]])
+        self.assertIsInstance(items[0][2], float)
+        self.assertEqual(fields, {'cursor': 12})
+
+    def test_fields_before_items_and_nested_values(self):
+        items, fields = self.parse(
+            '{"meta": {"a": [1, {"b": null}]}, "pids": [{"x": [1, [2]]}, 3, '
+            '"s", []], "ok": true}')
+        self.assertEqual(items, [{'x': [1, [2]]}, 3, 's', []])
+        self.assertEqual(fields, {'meta': {'a': [1, {'b': None}]}, 'ok': True})
+
+    def test_missing_items(self):
+        self.assertEqual(self.parse('{"cursor": "x"}'), ([], {'cursor': 'x'}))
+
+    def test_closes_when_done(self):
+        closed = []
+        stream = ItemStream('pids', fileobj=StringIO('{"pids": [1]}'),
+                            close=lambda: closed.append(True))
+        list(stream)
+        self.assertEqual(closed, [True])
+
+
+class TestStreamedPull(StandInTestCase):
+    client_config = {'sql_chunk_size': 7, 'incremental_pull': False}
+
+    def stored_pids(self):
+        pids = set(pid for (pid, ) in self.client.db.session.query(Payout.pid))
+        self.client.db.session.commit()
+        return pids
+
+    def test_bad_signature_raises_before_any_items(self):
+        self.sc.payouts = make_payouts(10)
+        self.sc.serializer = TimedSerializer('wrong secret')
+        with self.assertRaises(SCRPCException):
+            self.client.post('get_payouts', data={}, stream=True, items='pids')
+
+    def test_chunked_insert_with_repeats(self):
+        # Duplicates within and across chunks, and payouts already stored
+        self.sc.payouts = make_payouts(5)
+        self.client.pull_payouts()
+        self.sc.payouts = (make_payouts(20) + make_payouts(3) +
+                           make_payouts(4, start=18))
+        self.client.pull_payouts()
+        self.assertEqual(self.stored_pids(),
+                         set('pid{}'.format(i) for i in xrange(22)))
+
+    def test_insert_counts(self):
+        rows = [dict(pid=p[3], user=p[0], address=p[1], amount=p[2],
+                     amount_int=1, currency_code='TST')
+                for p in make_payouts(6) + make_payouts(2)]
+        self.assertEqual(self.client._insert_payouts(rows[:3]), (3, 0))
+        self.assertEqual(self.client._insert_payouts(rows), (3, 5))
+
+    def test_without_ijson(self):
+        self.sc.payouts = make_payouts(30)
+        original = sc_rpc.ijson
+        sc_rpc.ijson = None
+        try:
+            self.client.pull_payouts()
+        finally:
+            sc_rpc.ijson = original
+        self.assertEqual(len(self.stored_pids()), 30)
+
+    def test_warns_without_ijson(self):
+        log = LogMessages()
+        logger.addHandler(log)
+        original = sc_rpc.ijson
+        sc_rpc.ijson = None
+        try:
+            close_client(make_client(self.sc, self.daemon))
+        finally:
+            sc_rpc.ijson = original
+            logger.removeHandler(log)
+        self.assertTrue(any("ijson isn't installed" in message
+                            for message in log.messages))
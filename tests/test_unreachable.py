@@ -0,0 +1,76 @@
+import logging
+import time
+
+from simplecoin_rpc_client.sc_rpc import SCRPCDeadlineExceeded
+from tests.fakes import StandInTestCase, LogMessages, make_payouts, logger
+
+
+class TestSCUnreachable(StandInTestCase):
+    client_config = {'breaker_threshold': 2, 'breaker_cooldown': 60,
+                     'retry_attempts': 1}
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        self.log = LogMessages()
+        logger.addHandler(self.log)
+
+    def tearDown(self):
+        logger.removeHandler(self.log)
+        StandInTestCase.tearDown(self)
+
+    def assertOneLineWarnings(self):
+        self.assertTrue(self.log.records)
+        for record in self.log.records:
+            self.assertLess(record.levelno, logging.ERROR, record.getMessage())
+            self.assertIsNone(record.exc_info)
+
+    def test_open_circuit(self):
+        self.client.breaker.failure()
+        self.client.breaker.failure()
+        del self.log.records[:]
+        self.client.pull_payouts()
+        self.client.get_open_trade_requests()
+        self.client.confirm_trans()
+        self.assertEqual(self.sc.calls, [])
+        self.assertOneLineWarnings()
+        self.assertIn('is open', self.log.messages[-1])
+
+    def test_sc_down(self):
+        self.sc.payouts = make_payouts(5)
+        self.sc.stop()
+        # Without the circuit opening
+        self.client.breaker.threshold = 100
+        self.client.pull_payouts()
+        self.client.confirm_trans()
+        self.assertOneLineWarnings()
+
+
+class TestJobDeadlines(StandInTestCase):
+    client_config = {'job_deadlines': {'pull_payouts': 0.2}}
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        self.log = LogMessages()
+        logger.addHandler(self.log)
+
+    def tearDown(self):
+        logger.removeHandler(self.log)
+        StandInTestCase.tearDown(self)
+
+    def test_passed_before_calling(self):
+        with self.client._deadline(time.time() - 1):
+            with self.assertRaises(SCRPCDeadlineExceeded):
+                self.client.post('get_payouts')
+        self.assertEqual(self.sc.calls, [])
+
+    def test_read_cut_short(self):
+        self.sc.payouts = make_payouts(5)
+        self.sc.delay = 0.5
+        self.client.pull_payouts()
+        # Not retried, the deadline has already passed
+        self.assertEqual(len(self.sc.calls_to('get_payouts')), 1)
+        self.assertEqual([record.levelno for record in self.log.records],
+                         [logging.WARN])
+        self.assertIsNone(self.log.records[0].exc_info)
+        self.assertIn('pull_payouts ran out of time: Job deadline ran out '
+                      'waiting for get_payouts', self.log.messages[0])
@@ -0,0 +1,25 @@
+import unittest
+
+from simplecoin_rpc_client.sc_rpc import Payout
+from simplecoin_rpc_client.transport import msgpack, MsgpackPayload
+from tests.fakes import StandInTestCase, make_payouts
+
+
+@unittest.skipIf(msgpack is None, "msgpack isn't installed")
+class TestMsgpackWireFormat(StandInTestCase):
+    client_config = {'wire_formats': {'get_payouts': 'msgpack',
+                                      'associate_payouts': 'msgpack'}}
+
+    def test_pull_and_associate(self):
+        self.sc.payouts = make_payouts(50, addresses=10, amount=1)
+        self.client.pull_payouts()
+        self.assertEqual(self.client.db.session.query(Payout).count(), 50)
+        self.client.db.session.commit()
+
+        self.client.send_payout()
+        self.client.associate_all()
+        self.assertEqual(len(self.sc.associated), 50)
+        for name in ('get_payouts', 'associate_payouts'):
+            call = self.sc.calls_to(name)[-1]
+            self.assertEqual(call.headers['content-type'],
+                             MsgpackPayload.content_type)